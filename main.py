@@ -1,31 +1,71 @@
-import sys, pygame, random, json
+import sys, os, pygame, random, json
+from contextlib import nullcontext
+from functools import partial
 from OpenGL import *
-from scripts.utils import Animation, Tileset, load_image
+from scripts.utils import Animation, Tileset, load_image, get_ticks, advance_ticks
 from scripts.player import Player
-from scripts.tilemap import Tilemap
-from scripts.ui import SkillsUI
+from scripts.streaming import StreamingTilemap
+from scripts.tilemap import LAYERS, EMPTY
+from scripts.ui import SkillsUI, UILayer
 from scripts.buff import *
 from scripts.shaders import Shader
+from scripts.tile_renderer import TileRenderer
+from scripts.quality import AdaptiveQuality
+from scripts.profiler import FrameTimer
+from scripts.replay import Recording, Replay
 from scripts.particles import Particle, load_particle_images
+from scripts.text import get_font, render_text, glyph_atlas
+from scripts.assets import assets
 
 pygame.init()
 
 FONT = pygame.font.SysFont('data/texts/BoutiqueBitmap9x9_1.9.ttf', 24)
+# scale frames by whole numbers only and letterbox the rest of the screen
+INTEGER_SCALE = False
+# --dev recompiles edited shaders while the game runs
+DEV_MODE = '--dev' in sys.argv
+# lower post-processing resolution and effects when frames run long
+ADAPTIVE_QUALITY = True
+# the game advances in fixed steps and renders in between them, so it plays the same at any refresh rate
+SIM_STEP = 1 / 60
+# longer stalls are dropped instead of being caught up on all at once
+MAX_FRAME_TIME = 0.25
+# frames per second of the game scene, 0 renders as fast as possible
+FRAME_CAP = 60
+# --record <file> logs the game scene's input, --replay <file> plays such a log back instead of the keyboard
+RECORD_PATH = sys.argv[sys.argv.index('--record') + 1] if '--record' in sys.argv else None
+REPLAY_PATH = sys.argv[sys.argv.index('--replay') + 1] if '--replay' in sys.argv else None
 class Game():
-    def __init__(self, scene='menu'):
-        self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.OPENGL | pygame.DOUBLEBUF)
+    def __init__(self, scene='menu', ctx=None):
+        # with a standalone ctx (the benchmark) frames go to its bound framebuffer and no window is opened
+        if ctx:
+            self.screen = pygame.display.set_mode(ctx.fbo.size)
+        elif not hasattr(self, 'main_shader') or not self.main_shader.standalone:
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.OPENGL | pygame.DOUBLEBUF)
         pygame.display.set_caption('peak')
         
-        self.main_shader = Shader('shader', ['game_shader', 'ui_shader'])
+        # kept across restarts after the ending, together with its compiled programs
+        if not hasattr(self, 'main_shader'):
+            self.main_shader = Shader('shader', ['game_shader', 'ui_shader'], letterbox=INTEGER_SCALE, watch=DEV_MODE, ctx=ctx)
+        if getattr(self, 'quality', None):
+            self.quality.release()
+        self.quality = AdaptiveQuality(self.main_shader) if ADAPTIVE_QUALITY else None
+        # per stage frame times of the game scene, F3 shows them as a graph
+        self.timer = FrameTimer()
         
         # SET DISPLAY WIDTH, HEIGHT
         self.display = pygame.Surface((384, 216))
 
+        # composited on the gpu, see SCENE_LAYERS; main holds the entities
         self.displays = {
+            'particles': self.display.copy(),
+            'tiles': self.display.copy(),
             'main': self.display.copy(),
             'decoration': self.display.copy(),
             'ui': pygame.Surface((960, 540)),
         }
+        # the game scene keeps its ui retained and only re-uploads what changed
+        self.ui_layer = UILayer(self.displays['ui'].get_size())
         
         self.scenes = {
             'current': scene,
@@ -37,6 +77,13 @@ class Game():
         self.noise = {'cof': 1.0, 'target_cof': 1.0, 'speed': 0.025}
         
         self.clock = pygame.time.Clock()
+        self.frame_cap = FRAME_CAP
+        # seconds every game frame counts as instead of the measured time, for runs that have to repeat exactly
+        self.fixed_frame_time = None
+        self.recording = None
+        self.replay = None
+        # the ending that follows a replayed game scene still belongs to the replay
+        self.replayed = False
         self.movement = [False, False]
         
         self.checkpoint = [180, 100]
@@ -48,10 +95,10 @@ class Game():
         }
         
         self.sounds = {
-            'jump': pygame.mixer.Sound('data/sounds/jump.mp3'),
-            'death': pygame.mixer.Sound('data/sounds/death.mp3'),
-            'land': pygame.mixer.Sound('data/sounds/land.mp3'),
-            'dash': pygame.mixer.Sound('data/sounds/dash.mp3'),
+            'jump': assets.sound('data/sounds/jump.mp3'),
+            'death': assets.sound('data/sounds/death.mp3'),
+            'land': assets.sound('data/sounds/land.mp3'),
+            'dash': assets.sound('data/sounds/dash.mp3'),
         }
         
         self.animations = {
@@ -64,20 +111,30 @@ class Game():
             'player/land': Animation('data/assets/Animations/Player/land/anim1.png', img_dur=20, loop=False),
             'player/dash': Animation('data/assets/Animations/Player/dash/anim1.png', img_dur=1, loop=False),
             'player/death': Animation('data/assets/Animations/Player/death/anim1.png', img_dur=3, loop=False),
-            'danger_block/create': Animation('data/assets/map_tiles/test_map/anim1.png', img_dur=7, loop=False),
+            'danger_block/create': Animation('data/assets/map_tiles/test_map/anim1.png', img_dur=7, loop=False, rotate=True),
             'chekpoint/newpoint': Animation('data/assets/map_tiles/test_map/anim2.png', img_dur=7, loop=False),
         }
         
         self.player = Player(self, (50, 50), (8, 15))
         self.death_count = 0
         self.particles = []
+        self.particles_drawn = False
         
+        # a restart after the ending builds these again, the previous ones let go of their thread and textures
+        if hasattr(self, 'map'):
+            self.map['tilemap'].close()
+        if getattr(self, 'tile_renderer', None):
+            self.tile_renderer.release()
         self.map = {
             'name': 'map',
-            'tileset': Tileset("data/assets/map_tiles/test_map/tileset.png", 16).load_tileset(),
-            'tilemap': Tilemap(tile_size=16),
-            'rotatesset': {} 
+            'tileset': Tileset("data/assets/map_tiles/test_map/tileset.png", 16),
+            'tilemap': StreamingTilemap(tile_size=16, max_regions=48),
+            # (layer, x, y) -> (tile_id, quarter turns) edited since the level was loaded, for saves
+            'changes': {},
         }
+        self.map['tilemap'].subscribe(self.record_tile_change)
+        # set to None to draw tiles with the cpu chunk cache instead
+        self.tile_renderer = TileRenderer(self.main_shader, self.map['tileset'], self.map['tilemap'], self.display.get_size())
         
         self.death_vfx_timer = 0
         
@@ -108,17 +165,22 @@ class Game():
         
         self.prolog_completed = False
         
-        for sound in self.sounds.values():
-            sound.set_volume(min(sound.get_volume() * 2.2, 1.0)) 
-
         pygame.mixer.music.set_volume(min(pygame.mixer.music.get_volume() * 1.2, 1.0)) 
 
         self.load_data()
 
     # FUNCTIONS
+    def level_path(self, level_name):
+        # the binary level wins unless the editor json was saved after it, until convert_level is run again
+        path = 'data/levels/' + level_name
+        if os.path.exists(path + '.lvl'):
+            if not os.path.exists(path + '.json') or os.path.getmtime(path + '.lvl') >= os.path.getmtime(path + '.json'):
+                return path + '.lvl'
+        return path + '.json'
+
     def load_level(self, level_name):
-        self.map['tilemap'].load('data/levels/' + level_name + '.json')
-        self.map['rotateset'] = {}
+        self.map['tilemap'].load(self.level_path(level_name))
+        self.map['changes'] = {}
 
         self.anomaly_positions = [
             (355, 177),
@@ -146,42 +208,75 @@ class Game():
         self.death_vfx_timer = 0 
         
         self.scroll = [0, 0]
+        self.prev_scroll = [0, 0]
         self.render_scroll = [0,0]
 
-    def save_data(self):
-        data = {
+    def record_tile_change(self, change):
+        if change:
+            layer, x, y, old_id, tile_id, turns = change
+            self.map['changes'][(layer, x, y)] = (tile_id, turns)
+
+    def state(self):
+        return {
             'player_pos': list(self.player.pos),
             'checkpoint': list(self.checkpoint),
             'death_count': self.death_count,
-            'tilemap': self.map['tilemap'].tilemap,
+            'tile_changes': [[layer, x, y, tile_id, turns * 90] for (layer, x, y), (tile_id, turns) in self.map['changes'].items()],
             'level': self.map['name'],
-            'rotate_tiles': self.map['rotateset'],
             'scroll': self.scroll,
             'prolog_completed': self.prolog_completed
         }
+
+    def save_data(self):
+        # a replay never overwrites the save of whoever is watching it
+        if self.replay:
+            return
         
         with open("data/saves/save.json", "w") as outfile:
-            json.dump(data, outfile, indent=4)
+            json.dump(self.state(), outfile, indent=4)
+        
+    def load_state(self, data):
+        self.checkpoint = data.get('checkpoint', self.checkpoint)
+        self.death_count = data.get('death_count', self.death_count)
+        self.map['name'] = data.get('level', self.map['name'])
         
+        self.load_level(self.map['name'])
+        
+        # older saves stored the whole map
+        if 'tilemap' in data:
+            self.load_old_map(data['tilemap'], data.get('rotate_tiles', {}))
+        else:
+            self.map['tilemap'].rotateset = data.get('rotate_tiles', {})
+        
+        for layer, x, y, tile_id, rotation in data.get('tile_changes', []):
+            self.map['tilemap'].set_tile(layer, x, y, tile_id, rotation)
+        self.scroll = data.get('scroll', self.scroll)
+        self.prev_scroll = list(self.scroll)
+        self.player.pos = data.get('player_pos', self.player.pos)
+        self.player.prev_pos = list(self.player.pos)
+        self.prolog_completed = data.get('prolog_completed', self.prolog_completed) 
+
+    def load_old_map(self, tilemap, rotateset):
+        # only the tiles that differ from the level are set, so they end up in map['changes'] like any edit
+        level = self.map['tilemap'].tilemap
+        level_rotations = self.map['tilemap'].rotateset
+        for key in set(level) | set(tilemap):
+            layer = next(layer for layer, separator in LAYERS.items() if separator in key)
+            x, y = (int(n) for n in key.split(LAYERS[layer]))
+            tile_id = int(tilemap[key]['tile_id']) if key in tilemap else EMPTY
+            level_id = int(level[key]['tile_id']) if key in level else EMPTY
+            rotation = int(rotateset.get(key, 0)) if layer == 'background' else 0
+            level_rotation = int(level_rotations.get(key, 0)) if layer == 'background' else 0
+            if tile_id != level_id or rotation != level_rotation:
+                self.map['tilemap'].set_tile(layer, x, y, tile_id, rotation)
+
     def load_data(self):
         save_file = "data/saves/save.json"
         
         if os.path.exists(save_file):
             try:
                 with open(save_file, "r") as infile:
-                    data = json.load(infile)
-                    
-                    self.checkpoint = data.get('checkpoint', self.checkpoint)
-                    self.death_count = data.get('death_count', self.death_count)
-                    self.map['name'] = data.get('level', self.map['name'])
-                    
-                    self.load_level(self.map['name'])
-                    
-                    self.map['tilemap'].tilemap = data.get('tilemap', self.map['tilemap'].tilemap)
-                    self.map['rotateset'] = data.get('rotate_tiles', self.map['rotateset'])
-                    self.scroll = data.get('scroll', self.scroll)
-                    self.player.pos = data.get('player_pos', self.player.pos)
-                    self.prolog_completed = data.get('prolog_completed', self.prolog_completed) 
+                    self.load_state(json.load(infile))
                     
             except json.JSONDecodeError:
                 print("Warning: save.json is corrupted or empty. Initializing with default values.")
@@ -193,6 +288,27 @@ class Game():
                     return pos
         return False
 
+    # ui widget painter, bound with partial so the ui layer can repaint it later
+    def draw_text(self, surf, text, color, rect, alpha=255):
+        text_surface = render_text(FONT, text, color, alpha)
+        surf.blit(text_surface, rect)
+
+    # time and input of one game frame, from the keyboard or from a replay
+    def frame_input(self):
+        if self.replay:
+            pygame.event.pump()
+            frame = self.replay.next_frame()
+            if frame is None:
+                self.scenes['current'] = 'exit'
+                return 0, []
+            return frame
+
+        frame_time = self.fixed_frame_time or self.clock.get_time() / 1000
+        events = pygame.event.get()
+        if self.recording:
+            frame_time = self.recording.add(frame_time, events)
+        return frame_time, events
+
     def play_music(self, music_file, loops=-1, fade_ms=0):
         pygame.mixer.music.load(music_file)
         pygame.mixer.music.play(loops, fade_ms=fade_ms)
@@ -201,158 +317,145 @@ class Game():
         pygame.mixer.music.fadeout(fade_ms)
 
     # GAME
-    def game(self):
+    # one simulation step of SIM_STEP seconds, everything that counts frames advances here
+    def step(self):
+        #  NOISE
+        self.anomaly_near = self.is_anomaly_near()
         
-        self.play_music(self.music['game'], fade_ms=2000)
-
-        while self.scenes['current'] == 'game':
-            self.t += self.clock.get_time() / 1000
-
-            #  NOISE
-            self.anomaly_near = self.is_anomaly_near()
-            
-            if self.anomaly_near:
-                self.noise['target_cof'] = 1.5
-                
-                if self.anomaly_near[1] == -719:
-                    self.noise['target_cof'] = 3
-                 
-            else:
-                self.noise['target_cof'] = 1.0 
-                
-            self.noise['cof'] += (self.noise['target_cof'] - self.noise['cof']) * self.noise['speed']
-            
-            
-            # DISPLAYS
-            self.displays['ui'].fill((0,0,0))
-            self.displays['main'].fill((0, 0, 0))
-            self.displays['decoration'].fill((0, 0, 0))
-            
-            self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 25
-            self.scroll[1] += ((self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1])-25) / 25
-            self.render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
+        if self.anomaly_near:
+            self.noise['target_cof'] = 1.5
             
-            self.map['tilemap'].render(
-                self.displays['main'],
-                self.displays['decoration'],
-                self.map['tileset'],
-                self.map['rotatesset'],
-                offset=self.render_scroll
-            )
-            
-            tilemap_surf = self.displays['main'].copy().convert_alpha()
-            tilemap_surf.set_colorkey((0,0,0))
+            if self.anomaly_near[1] == -719:
+                self.noise['target_cof'] = 3
+             
+        else:
+            self.noise['target_cof'] = 1.0 
             
-            # PARTICLES
-            if 0 <= self.player.pos[0] - self.scroll[0] < self.displays['main'].get_width() and 0 <= self.player.pos[1] - self.scroll[1] + 1 < self.displays['main'].get_height():
-                if self.player.action == 'run':
-                    for i in range(random.randint(1,3)):
-                        if random.randint(1,20) == 1:
-                            
-                            if random.randint(1,10) == 5:
-                                particle_color = (51,51,51)
-                            elif random.randint(1,25) == 5:
-                                particle_color = (140,140,140)
-                            else:
-                                particle_color = self.displays['main'].get_at((self.player.pos[0] + self.player.size[0] - self.scroll[0], self.player.pos[1] + self.player.size[1] - self.scroll[1] + 1))
-                            
-                            self.particles.append(
-                                Particle(
-                                    self.player.pos[0] + self.player.size[0] // 2 + random.randint(-3, 3),
-                                    self.player.pos[1] + self.player.size[1]-1,
-                                    'grass', 
-                                    [self.player.velocity[0], -0.1],
-                                    0.5, 
-                                    0,
-                                    particle_color,
-                                    alpha=200
-                                ))
-                            
-                if self.player.action == 'land':
-                    
-                    for i in range(random.randint(1,2)):
-                        if i == 1:
-                            if random.randint(1,10) == 5:
-                                particle_color = (51,51,51)
-                            else:
-                                x = self.player.pos[0] + self.player.size[0] - self.scroll[0]
-                                y = self.player.pos[1] + self.player.size[1] - self.scroll[1] + 1
-                                width, height = self.displays['main'].get_size()
-                                if 0 <= x < width and 0 <= y < height:
-                                    particle_color = self.displays['main'].get_at((x, y))
-                                else:
-                                    particle_color = (0, 0, 0, 0) 
-                            
-                            if random.randint(1,2) == 1:
-                                x = -1.2
-                            else:
-                                x = 1.2
-                            
-                            self.particles.append(
-                                Particle(
-                                    self.player.pos[0] + self.player.size[0] // 2 + random.randint(-3, 3),
-                                    self.player.pos[1] + self.player.size[1]-1,
-                                    'grass', 
-                                    [x, -0.2],
-                                    0.5, 
-                                    0,
-                                    particle_color,
-                                    alpha=200
-                                ))
-                
-                if self.player.action == 'jump':
+        self.noise['cof'] += (self.noise['target_cof'] - self.noise['cof']) * self.noise['speed']
+        
+        
+        # CAMERA
+        self.prev_scroll = list(self.scroll)
+        self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 25
+        self.scroll[1] += ((self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1])-25) / 25
+
+        # PARTICLES
+        if 0 <= self.player.pos[0] - self.scroll[0] < self.displays['main'].get_width() and 0 <= self.player.pos[1] - self.scroll[1] + 1 < self.displays['main'].get_height():
+            if self.player.action == 'run':
+                for i in range(random.randint(1,3)):
+                    if random.randint(1,20) == 1:
+                        
+                        if random.randint(1,10) == 5:
+                            particle_color = (51,51,51)
+                        elif random.randint(1,25) == 5:
+                            particle_color = (140,140,140)
+                        else:
+                            particle_color = self.map['tilemap'].color_at(self.map['tileset'], (self.player.pos[0] + self.player.size[0], self.player.pos[1] + self.player.size[1] + 1))
                         
-                    if random.randint(1,int(50)) == 1:
                         self.particles.append(
                             Particle(
                                 self.player.pos[0] + self.player.size[0] // 2 + random.randint(-3, 3),
                                 self.player.pos[1] + self.player.size[1]-1,
                                 'grass', 
-                                [0, 1],
+                                [self.player.velocity[0], -0.1],
                                 0.5, 
                                 0,
-                                (150,150,150),
+                                particle_color,
                                 alpha=200
                             ))
-
-                if self.player.action == 'wall_slide':
-                    for i in range(random.randint(1,3)):
-                        if random.randint(1,10) == 1:
-                            particle_color = (140,140,140, 150)
-                            if random.randint(1,10) == 5:
-                                particle_color = (51,51,51, 150)
                         
-                            if self.player.flip:
-                                kef = -1.5
-                            else:
-                                kef = 2.7
-                                
-                            self.particles.append(
-                                Particle(
-                                    self.player.pos[0] + self.player.size[0] // 2 + kef,
-                                    self.player.pos[1],
-                                    'grass', 
-                                    [0, (self.player.velocity[0]*-1)*2],
-                                    0.5, 
-                                    0,
-                                    particle_color,
-                                    alpha=200
-                                ))
-                        
-            for particle in self.particles[:]:
-                particle.update(self.clock.get_time() / 45)
-                
-            for particle in self.particles:
-                particle.draw(self.displays['main'], self.scroll)
+            if self.player.action == 'land':
                 
-            self.displays['main'].blit(tilemap_surf)
-
-            # PLAYER
-            self.player.update(self.map['tilemap'], (self.movement[1] - self.movement[0], 0))
-            self.player.render(self.displays['main'], offset=self.render_scroll)
+                for i in range(random.randint(1,2)):
+                    if i == 1:
+                        if random.randint(1,10) == 5:
+                            particle_color = (51,51,51)
+                        else:
+                            particle_color = self.map['tilemap'].color_at(self.map['tileset'], (self.player.pos[0] + self.player.size[0], self.player.pos[1] + self.player.size[1] + 1))
+                        
+                        if random.randint(1,2) == 1:
+                            x = -1.2
+                        else:
+                            x = 1.2
+                        
+                        self.particles.append(
+                            Particle(
+                                self.player.pos[0] + self.player.size[0] // 2 + random.randint(-3, 3),
+                                self.player.pos[1] + self.player.size[1]-1,
+                                'grass', 
+                                [x, -0.2],
+                                0.5, 
+                                0,
+                                particle_color,
+                                alpha=200
+                            ))
             
+            if self.player.action == 'jump':
+                    
+                if random.randint(1,int(50)) == 1:
+                    self.particles.append(
+                        Particle(
+                            self.player.pos[0] + self.player.size[0] // 2 + random.randint(-3, 3),
+                            self.player.pos[1] + self.player.size[1]-1,
+                            'grass', 
+                            [0, 1],
+                            0.5, 
+                            0,
+                            (150,150,150),
+                            alpha=200
+                        ))
+
+            if self.player.action == 'wall_slide':
+                for i in range(random.randint(1,3)):
+                    if random.randint(1,10) == 1:
+                        particle_color = (140,140,140, 150)
+                        if random.randint(1,10) == 5:
+                            particle_color = (51,51,51, 150)
+                    
+                        if self.player.flip:
+                            kef = -1.5
+                        else:
+                            kef = 2.7
+                            
+                        self.particles.append(
+                            Particle(
+                                self.player.pos[0] + self.player.size[0] // 2 + kef,
+                                self.player.pos[1],
+                                'grass', 
+                                [0, (self.player.velocity[0]*-1)*2],
+                                0.5, 
+                                0,
+                                particle_color,
+                                alpha=200
+                            ))
+                    
+        # finished particles are dropped, and an empty layer is not redrawn or uploaded again
+        self.particles = [particle for particle in self.particles if particle.update(SIM_STEP * 1000 / 45)]
+        self.timer.mark('particles')
+
+        # PLAYER
+        self.player.update(self.map['tilemap'], (self.movement[1] - self.movement[0], 0))
+        self.timer.mark('player')
+
+    def game(self):
+        
+        self.play_music(self.music['game'], fade_ms=2000)
+        self.accumulator = 0
+        # a replay puts the game back into the state its recording started from
+        if self.replay:
+            self.replay.restore(self)
+        elif RECORD_PATH:
+            self.recording = Recording(RECORD_PATH, self)
+
+        while self.scenes['current'] == 'game':
+            self.timer.begin()
+            frame_time, events = self.frame_input()
+            self.t += frame_time
+            advance_ticks(frame_time * 1000)
+            self.accumulator += min(frame_time, MAX_FRAME_TIME)
+
             # EVENTS
-            for event in pygame.event.get():
+            for event in events:
                     
                 if event.type == pygame.QUIT:
                     self.scenes['sub_scene'] = 'exit'
@@ -364,7 +467,11 @@ class Game():
                         self.movement[0] = True
                         
                     if event.key == pygame.K_0:
-                        self.map['tilemap'].load('data/levels/' + self.map['name'] + '.json')
+                        self.map['tilemap'].load(self.level_path(self.map['name']))
+                        self.map['changes'] = {}
+                        
+                    if event.key == pygame.K_F3:
+                        self.timer.toggle()
                         
                     if event.key == pygame.K_d:
                         self.movement[1] = True
@@ -390,7 +497,7 @@ class Game():
                         self.button_conditions['screenshot'] = True
                         self.ui['screenshot'].active = False
                         self.screenshot_vfx['enabled'] = True
-                        self.screenshot_vfx['start_time'] = pygame.time.get_ticks()
+                        self.screenshot_vfx['start_time'] = get_ticks()
 
                 if event.type == pygame.KEYUP:
                     
@@ -405,54 +512,101 @@ class Game():
                         self.movement[0] = False
                     if event.key == pygame.K_d:
                         self.movement[1] = False
+            self.timer.mark('events')
             
-            # GAME RENDER   
-            offset_x = (self.displays['main'].get_width() - self.displays['main'].get_width()) // 2
-            offset_y = (self.displays['main'].get_height() - self.displays['main'].get_height()) // 2
+            # SIMULATION
+            steps = 0
+            while self.accumulator >= SIM_STEP:
+                self.step()
+                self.accumulator -= SIM_STEP
+                steps += 1
+            # how far this frame lies between the last two steps
+            alpha = self.accumulator / SIM_STEP
 
-            self.display.blit(self.displays['main'], (offset_x, offset_y))
+            # DISPLAYS
+            self.displays['main'].fill((0, 0, 0))
+            
+            self.render_scroll = (int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha),
+                                  int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha))
+            
+            self.map['tilemap'].stream(self.render_scroll, self.display.get_size())
+            # layers named in changed are the ones the compositor has to pick up again this frame
+            changed = {'entities'}
+            if self.tile_renderer:
+                layers, tiles_changed = self.tile_renderer.render(self.render_scroll)
+                changed |= tiles_changed
+            else:
+                self.displays['tiles'].fill((0, 0, 0))
+                self.displays['decoration'].fill((0, 0, 0))
+                self.map['tilemap'].render(
+                    self.displays['tiles'],
+                    self.displays['decoration'],
+                    self.map['tileset'],
+                    offset=self.render_scroll
+                )
+                layers = {'background': self.displays['tiles'], 'decoration': self.displays['decoration']}
+                changed |= {'background', 'decoration'}
+            layers['particles'] = self.displays['particles']
+            layers['entities'] = self.displays['main']
+            self.timer.mark('tilemap')
+            
+            # PARTICLES
+            if self.particles or self.particles_drawn:
+                self.displays['particles'].fill((0, 0, 0))
+                for particle in self.particles:
+                    particle.draw(self.displays['particles'], self.render_scroll)
+                changed.add('particles')
+            self.particles_drawn = bool(self.particles)
+            self.timer.mark('particles')
 
-            self.displays['decoration'].set_colorkey((0, 0, 0))
-            self.display.blit(self.displays['decoration'], (offset_x, offset_y))
+            # PLAYER
+            self.player.render(self.displays['main'], offset=self.render_scroll, alpha=alpha)
+            self.timer.mark('player')
             
-            screen_surface = pygame.transform.scale(self.display, self.screen.get_size())
+            # GAME RENDER   
+            scene = self.main_shader.composite(layers, changed)
+            self.timer.mark('upload')
             
             # UI RENDER
-            img = FONT.render(str(int(self.clock.get_fps())), True, (255, 255, 255))
-            self.displays['ui'].blit(img, (930, 10))
+            ui = self.ui_layer
+            screen_rect = ui.surf.get_rect()
+
+            timer_state = self.timer.update()
+            timer_rect = self.timer.bounds(FONT)
+            ui.widget('timer', timer_state, timer_rect, partial(self.timer.draw, font=FONT, rect=timer_rect))
         
             for name, obj in self.ui.items():
                 state = 'pressed' if (name in self.button_conditions and self.button_conditions[name]) else None
-                obj.render(self.displays['ui'], state)
+                ui.widget(name, obj.update(state), obj.bounds(), obj.draw)
             
             for name, obj in self.player.buffs.items():
-                obj.ui.render(self.displays['ui'], list(self.player.buffs).index(name))
+                ui.widget('buff/' + name, obj.ui.update(list(self.player.buffs).index(name)), obj.ui.bounds(), obj.ui.draw)
                 if obj.ui.end:
                     self.player.buffs = {}
                     break
 
             if self.anomaly_text_vfx['enabled']:
                     if self.anomaly_text_vfx['timer'] == 0:
-                        self.anomaly_text_vfx['timer'] = pygame.time.get_ticks()
+                        self.anomaly_text_vfx['timer'] = get_ticks()
                     
-                    elapsed_time = pygame.time.get_ticks() - self.anomaly_text_vfx['timer']
+                    elapsed_time = get_ticks() - self.anomaly_text_vfx['timer']
                     
                     if elapsed_time < self.anomaly_text_vfx['duration']:
                         if elapsed_time < self.anomaly_text_vfx['duration'] / 2:
-                            self.anomaly_text_vfx['alpha'] = min(255, self.anomaly_text_vfx['alpha'] + 10)
+                            self.anomaly_text_vfx['alpha'] = min(255, self.anomaly_text_vfx['alpha'] + 10 * steps)
                         else:
-                            self.anomaly_text_vfx['alpha'] = max(0, self.anomaly_text_vfx['alpha'] - 10)
+                            self.anomaly_text_vfx['alpha'] = max(0, self.anomaly_text_vfx['alpha'] - 10 * steps)
                             
                         if self.anomaly_near:
-                            text_surface = FONT.render("Anomaly is near you!!!", True, (252, 3, 3))
+                            text, color = "Anomaly is near you!!!", (252, 3, 3)
                             
                         else:
-                            text_surface = FONT.render("Anomaly not founded", True, (255, 255, 255))
-                            
-                        text_surface.set_alpha(self.anomaly_text_vfx['alpha'])
+                            text, color = "Anomaly not founded", (255, 255, 255)
                         
-                        text_rect = text_surface.get_rect(center=(self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2 + 150))
-                        self.displays['ui'].blit(text_surface, text_rect)
+                        text_rect = pygame.Rect((0, 0), FONT.size(text))
+                        text_rect.center = (screen_rect.width // 2, screen_rect.height // 2 + 150)
+                        ui.widget('anomaly_text', (text, self.anomaly_text_vfx['alpha']), text_rect,
+                                  partial(self.draw_text, text=text, color=color, rect=text_rect, alpha=self.anomaly_text_vfx['alpha']))
                         
                     else:
                         self.anomaly_text_vfx['timer'] = 0
@@ -461,21 +615,16 @@ class Game():
                     
             
             if self.screenshot_vfx['enabled']:
-                current_time = pygame.time.get_ticks()
+                current_time = get_ticks()
                 elapsed_time = current_time - self.screenshot_vfx['start_time']
                 
                 if elapsed_time < self.screenshot_vfx['duration']:
                     
-                    self.displays['ui'].fill((1,0,0))
-                    
                     progress = elapsed_time / self.screenshot_vfx['duration'] 
                 
                     self.screenshot_vfx['alpha'] = int(255 * (1 - progress) ** 2) 
                     
-                    flash_surface = pygame.Surface(self.screen.get_size())
-                    flash_surface.fill((255, 255, 255))  
-                    flash_surface.set_alpha(self.screenshot_vfx['alpha'])
-                    self.displays['ui'].blit(flash_surface, (0, 0)) 
+                    self.main_shader.set_overlay(fill=(1, 0, 0), flash=self.screenshot_vfx['alpha'])
                     
                     if self.screenshot_vfx['alpha'] < 10:
                         self.transition_vfx['value'] = 30
@@ -491,26 +640,16 @@ class Game():
                         self.player.left_channel_bust.play(self.player.sounds['anomaly_0'])
                         
             if self.transition_vfx['value']:
-                transition_surf = pygame.Surface(self.displays['ui'].get_size())
-                transition_surf.fill((1,0,0))
-                
                 if self.transition_vfx['value'] > 0:
                     if self.player.death or self.screenshot_vfx['alpha'] < 10 or self.scenes['sub_scene'] == 'exit':
-                        pygame.draw.circle(
-                            transition_surf, 
-                            (255, 255, 255), 
-                            (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), 
-                            max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1)
-                        )
-
-                        transition_surf.set_colorkey((255, 255, 255))
-                        self.displays['ui'].blit(transition_surf, (0, 0))
+                        radius = max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1)
+                        self.main_shader.set_overlay(fill=(1, 0, 0), radius=radius, flash=self.screenshot_vfx['alpha'] if self.screenshot_vfx['enabled'] else None)
                         
-                        self.transition_vfx['value'] -= self.transition_vfx['speed'] * 2
+                        self.transition_vfx['value'] -= self.transition_vfx['speed'] * 2 * steps
                         
                         if self.transition_vfx['value'] <= 0:
                             self.transition_vfx['value'] = 0
-                            self.death_vfx_timer = pygame.time.get_ticks()
+                            self.death_vfx_timer = get_ticks()
                             
                             if self.scenes['sub_scene'] == 'ending':
                                 self.scenes['current'] = self.scenes['sub_scene']
@@ -525,32 +664,45 @@ class Game():
                                 break 
 
                     else:
-                        pygame.draw.circle(transition_surf, (255, 255, 255), (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), (30 - abs(self.transition_vfx['value'])) * 15)
-                        transition_surf.set_colorkey((255, 255, 255))
-                        self.displays['ui'].blit(transition_surf, (0, 0))
+                        radius = (30 - abs(self.transition_vfx['value'])) * 15
+                        self.main_shader.set_overlay(fill=(1, 0, 0), radius=radius, flash=self.screenshot_vfx['alpha'] if self.screenshot_vfx['enabled'] else None)
                         
-                        self.transition_vfx['value'] -= self.transition_vfx['speed']
+                        self.transition_vfx['value'] -= self.transition_vfx['speed'] * steps
                         if self.transition_vfx['value'] <= 0:
                             self.transition_vfx['value'] = 0
                         
            
             elif self.player.death:
                 if self.death_vfx_timer > 0:
-                    current_time = pygame.time.get_ticks()
-                    self.displays['ui'].fill((1, 0, 0)) 
+                    current_time = get_ticks()
+                    self.main_shader.set_overlay(fill=(1, 0, 0), radius=0)
                     if current_time - self.death_vfx_timer >= 250:
                         self.load_level(self.map['name'])
                         self.death_count += 1
                         self.scroll[0] = (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) 
                         self.scroll[1] = ((self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1])-25) 
+                        self.prev_scroll = list(self.scroll)
                         self.render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
             
             
             # UPDATE
-            self.main_shader.render(self.t, screen_surface, self.displays['ui'], self.noise['cof'])
+            ui_rects = ui.flush()
+            self.timer.mark('ui')
+            with self.quality.gpu_timer() if self.quality else nullcontext():
+                self.main_shader.render(self.t, scene, ui.surf, self.noise['cof'], ui_rects)
+            self.timer.mark('shader')
+            work_ms = self.timer.end()
                                      
             pygame.display.flip()
-            self.clock.tick(60)
+            self.clock.tick(self.frame_cap)
+            if self.quality:
+                self.quality.update(work_ms)
+
+        if self.recording:
+            self.recording.save()
+            self.recording = None
+        self.replayed = bool(self.replay)
+        self.replay = None
 
     # MAIN MENU
     def menu(self):
@@ -559,18 +711,16 @@ class Game():
         start_font = pygame.font.Font('data/texts/font_7x7.ttf', 24)
         start_text = start_font.render('Play', True, (255, 255, 255))
         start_rect = start_text.get_rect(center=(self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2 + 50))
+        background = load_image('data/background/menu.png')
         
         self.play_music(self.music['menu'], fade_ms=2000)
         
         while self.scenes['current'] == 'menu':
                         
             self.t += self.clock.get_time() / 1000
-            self.displays['ui'].blit(load_image('data/background/menu.png'))
+            self.displays['ui'].blit(background)
             
-            mpos = pygame.mouse.get_pos()
-            scale_x = self.displays['ui'].get_width() / self.screen.get_width()
-            scale_y = self.displays['ui'].get_height() / self.screen.get_height()
-            mpos_display = (int(mpos[0] * scale_x), int(mpos[1] * scale_y))
+            mpos_display = self.main_shader.to_frame(pygame.mouse.get_pos(), self.displays['ui'].get_size())
             
             hover = start_rect.collidepoint(mpos_display)
             
@@ -592,18 +742,8 @@ class Game():
                         self.transition_vfx['value'] = 3
             
             if self.transition_vfx['value']:
-                transition_surf = pygame.Surface(self.displays['ui'].get_size())
-                transition_surf.fill((10,10,10))
-                
                 if self.scenes['sub_scene'] in ['exit', 'prologue']:
-                    pygame.draw.circle(
-                        transition_surf, 
-                        (255, 255, 255), 
-                        (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), 
-                        max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1)
-                    )
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1))
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed']
                     
@@ -615,9 +755,7 @@ class Game():
                         break  
                 
                 else:
-                    pygame.draw.circle(transition_surf, (255, 255, 255), (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), (30 - abs(self.transition_vfx['value'])) * 15)
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=(30 - abs(self.transition_vfx['value'])) * 15)
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed'] * 2
                     if self.transition_vfx['value'] <= 0:
@@ -641,7 +779,9 @@ class Game():
             "                    Dear NUmber 8"
         ]
 
-        story_font = pygame.font.Font('data/texts/font_7x7.ttf', 24)
+        story_font = get_font('data/texts/font_7x7.ttf', 24)
+        # finished lines are cached whole, the line being typed is put together from the glyph atlas
+        story_glyphs = glyph_atlas(story_font, (255, 255, 255))
         
         current_text = [""] * len(story_text)  
         char_index = 0 
@@ -667,9 +807,14 @@ class Game():
                     char_index = 0
 
             y_offset = 200
-            for line in current_text:
-                if line: 
-                    text_surface = story_font.render(line, True, (255, 255, 255))
+            for i, line in enumerate(current_text):
+                if line and i == line_index:
+                    text_rect = pygame.Rect((0, 0), story_glyphs.size(line))
+                    text_rect.center = (self.displays['ui'].get_width() // 2, y_offset)
+                    story_glyphs.draw(self.displays['ui'], line, text_rect.topleft)
+                    y_offset += 40
+                elif line: 
+                    text_surface = render_text(story_font, line, (255, 255, 255))
                     text_rect = text_surface.get_rect(center=(self.displays['ui'].get_width() // 2, y_offset))
                     self.displays['ui'].blit(text_surface, text_rect)
                     y_offset += 40
@@ -708,18 +853,8 @@ class Game():
                             self.stop_music(fade_ms=2000)
                             
             if self.transition_vfx['value']:
-                transition_surf = pygame.Surface(self.displays['ui'].get_size())
-                transition_surf.fill((10,10,10))
-                
                 if self.scenes['sub_scene'] in ['exit', 'game']:
-                    pygame.draw.circle(
-                        transition_surf, 
-                        (255, 255, 255), 
-                        (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), 
-                        max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1)
-                    )
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1))
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed']
                     
@@ -730,9 +865,7 @@ class Game():
                         break  
                 
                 else:
-                    pygame.draw.circle(transition_surf, (255, 255, 255), (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), (30 - abs(self.transition_vfx['value'])) * 15)
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=(30 - abs(self.transition_vfx['value'])) * 15)
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed'] * 2
                     if self.transition_vfx['value'] <= 0:
@@ -759,7 +892,9 @@ class Game():
             for i in range(15):
                 story_text.append(f"That end.That end.That end.That end.That end.That end.That end.That end.That end.That end.")
             
-        story_font = pygame.font.Font('data/texts/font_7x7.ttf', 24)
+        story_font = get_font('data/texts/font_7x7.ttf', 24)
+        # finished lines are cached whole, the line being typed is put together from the glyph atlas
+        story_glyphs = glyph_atlas(story_font, (255, 255, 255))
         
         current_text = [""] * len(story_text)  
         char_index = 0 
@@ -770,9 +905,11 @@ class Game():
         transition_timer = 0
         transition_delay = 5000  
 
-        with open('data/saves/save.json', "w") as file:
-            json.dump({}, file, indent=4)
-        self.__init__(scene='ending')
+        # a replay leaves the save and the game of whoever is watching it alone
+        if not self.replayed:
+            with open('data/saves/save.json', "w") as file:
+                json.dump({}, file, indent=4)
+            self.__init__(scene='ending')
 
         while self.scenes['current'] == 'ending':
             self.t += self.clock.get_time() / 1000
@@ -789,9 +926,14 @@ class Game():
                     char_index = 0
 
             y_offset = 25
-            for line in current_text:
-                if line: 
-                    text_surface = story_font.render(line, True, (255, 255, 255))
+            for i, line in enumerate(current_text):
+                if line and i == line_index:
+                    text_rect = pygame.Rect((0, 0), story_glyphs.size(line))
+                    text_rect.center = (self.displays['ui'].get_width() // 2, y_offset)
+                    story_glyphs.draw(self.displays['ui'], line, text_rect.topleft)
+                    y_offset += 40
+                elif line: 
+                    text_surface = render_text(story_font, line, (255, 255, 255))
                     text_rect = text_surface.get_rect(center=(self.displays['ui'].get_width() // 2, y_offset))
                     self.displays['ui'].blit(text_surface, text_rect)
                     y_offset += 40
@@ -808,18 +950,8 @@ class Game():
                     self.transition_vfx['value'] = 30
                     
             if self.transition_vfx['value']:
-                transition_surf = pygame.Surface(self.displays['ui'].get_size())
-                transition_surf.fill((10,10,10))
-                
                 if self.scenes['sub_scene'] in ['exit', 'menu']:
-                    pygame.draw.circle(
-                        transition_surf, 
-                        (255, 255, 255), 
-                        (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), 
-                        max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1)
-                    )
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=max(0, 435 - ((-30+self.transition_vfx['value'])*-1) * 15) // (25 if self.scenes['sub_scene'] == 'exit' else 1))
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed']
                     
@@ -830,9 +962,7 @@ class Game():
                         break  
                 
                 else:
-                    pygame.draw.circle(transition_surf, (255, 255, 255), (self.displays['ui'].get_width() // 2, self.displays['ui'].get_height() // 2), (30 - abs(self.transition_vfx['value'])) * 15)
-                    transition_surf.set_colorkey((255, 255, 255))
-                    self.displays['ui'].blit(transition_surf, (0, 0))
+                    self.main_shader.set_overlay(fill=(10, 10, 10), radius=(30 - abs(self.transition_vfx['value'])) * 15)
                     
                     self.transition_vfx['value'] -= self.transition_vfx['speed'] * 2
                     if self.transition_vfx['value'] <= 0:
@@ -844,7 +974,9 @@ class Game():
 
 # SCENES CONTROLL
 if __name__ == "__main__":
-    game = Game()
+    game = Game('game' if REPLAY_PATH else 'menu')
+    if REPLAY_PATH:
+        game.replay = Replay(REPLAY_PATH)
 
     while True:
         
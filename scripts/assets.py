@@ -0,0 +1,49 @@
+import os
+
+import pygame
+
+class Assets:
+    # every image and sound is read from disk once and shared after that; callers must not draw on the images,
+    # they are handed to everything that asked for the same path
+    def __init__(self):
+        self.images = {}
+        self.sounds = {}
+        # path -> times it was asked for
+        self.requests = {}
+
+    def image(self, path, colorkey=(0, 0, 0)):
+        key = (path, colorkey)
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if key not in self.images:
+            img = pygame.image.load(path).convert()
+            if colorkey is not None:
+                img.set_colorkey(colorkey)
+            self.images[key] = img
+        return self.images[key]
+
+    def sound(self, path):
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if path not in self.sounds:
+            self.sounds[path] = pygame.mixer.Sound(path)
+        return self.sounds[path]
+
+    def report(self):
+        images = {}
+        for (path, colorkey), img in self.images.items():
+            images[path] = {'size': list(img.get_size()), 'bytes': img.get_bytesize() * img.get_width() * img.get_height(),
+                            'requests': self.requests[path]}
+        sounds = {}
+        if self.sounds:
+            frequency, size, channels = pygame.mixer.get_init()
+            for path, sound in self.sounds.items():
+                sounds[path] = {'bytes': int(sound.get_length() * frequency) * channels * abs(size) // 8,
+                                'requests': self.requests[path]}
+        return {
+            'images': images,
+            'sounds': sounds,
+            'image_bytes': sum(image['bytes'] for image in images.values()),
+            'sound_bytes': sum(sound['bytes'] for sound in sounds.values()),
+            'disk_bytes': sum(os.path.getsize(path) for path in set(images) | set(sounds)),
+        }
+
+assets = Assets()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# the real game loop without a display: dummy sdl drivers and a standalone egl context
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import moderngl
+import pygame
+
+import main
+from scripts.assets import assets
+from scripts.profiler import FrameTimer
+from scripts.replay import Replay
+
+# python -m scripts.benchmark --frames 1200 --out bench.json
+# a script is json: {"frames": 600, "inputs": [[frame, key, pressed], ...]} with pygame key names, frames
+# count from the first measured one; --replay session.rec measures a recorded session with its own frame times
+DEFAULT_SCRIPT = {
+    'frames': 900,
+    'inputs': [[10, 'd', True]] + [[frame + i, 'w', i == 0] for frame in range(60, 900, 75) for i in (0, 12)]
+              + [[240, 'q', True], [241, 'q', False], [480, 'd', False], [480, 'a', True], [700, 'a', False]],
+}
+
+class BenchmarkGame(main.Game):
+    # the game scene fed from a script or a replay; saves and music are left alone
+    def __init__(self, script, ctx, warmup, replay=None):
+        self.frame = 0
+        self.frames = script['frames']
+        self.warmup = warmup
+        self.warmup_report = None
+        self.start = time.perf_counter()
+        self.inputs = {}
+        for frame, key, pressed in script['inputs']:
+            self.inputs.setdefault(frame, []).append((pygame.key.key_code(key), pressed))
+        super().__init__(scene='game', ctx=ctx)
+        self.replay = replay
+
+    def frame_input(self):
+        self.frame += 1
+        # the first frames compile, allocate and upload everything and are measured apart
+        if self.frame == self.warmup + 1:
+            self.warmup_report = self.timer.report()
+            self.timer = FrameTimer(window=self.frames)
+            self.start = time.perf_counter()
+        if self.frame >= self.warmup + self.frames:
+            self.scenes['current'] = 'benchmark'
+
+        if self.replay:
+            return super().frame_input()
+
+        pygame.event.pump()
+        return self.fixed_frame_time, [pygame.event.Event(pygame.KEYDOWN if pressed else pygame.KEYUP, key=key)
+                                       for key, pressed in self.inputs.get(self.frame - self.warmup, [])]
+
+    def load_data(self):
+        pass
+
+    def save_data(self):
+        pass
+
+    def play_music(self, music_file, loops=-1, fade_ms=0):
+        pass
+
+    def stop_music(self, fade_ms=0):
+        pass
+
+def run(script, size=(1920, 1080), frame_cap=0, warmup=60, adaptive=False, seed=0, replay=None):
+    ctx = moderngl.create_standalone_context(backend='egl')
+    ctx.simple_framebuffer(size).use()
+
+    random.seed(seed)
+    if replay:
+        # a replay brings its own input and frame times, the warmup is its first frames
+        script = {'frames': len(replay) - warmup, 'inputs': []}
+    game = BenchmarkGame(script, ctx, warmup, replay)
+    game.frame_cap = frame_cap
+    # every scripted frame is one simulation step, so each run does the same work whatever the machine
+    game.fixed_frame_time = main.SIM_STEP
+    if not adaptive:
+        game.quality = None
+    game.timer = FrameTimer(window=max(1, warmup))
+
+    game.game()
+    elapsed = time.perf_counter() - game.start
+    ctx.finish()
+
+    frames = len(game.timer.totals())
+    return {
+        'frames': frames,
+        'seconds': round(elapsed, 3),
+        'fps': round(frames / elapsed, 2) if elapsed else 0,
+        'size': list(size),
+        'frame_cap': frame_cap,
+        'renderer': ctx.info['GL_RENDERER'],
+        'warmup': game.warmup_report,
+        'stages': game.timer.report(),
+        'assets': assets.report(),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time the game scene without a display')
+    parser.add_argument('--script', help='json input script, a built-in run and jump when left out')
+    parser.add_argument('--replay', help='recording made with main.py --record to measure instead of a script')
+    parser.add_argument('--frames', type=int, help='frames to measure, overrides the script')
+    parser.add_argument('--size', default='1920x1080', help='framebuffer size as WIDTHxHEIGHT')
+    parser.add_argument('--fps', type=int, default=0, help='frame cap, 0 runs uncapped')
+    parser.add_argument('--warmup', type=int, default=60, help='frames run before measuring')
+    parser.add_argument('--adaptive', action='store_true', help='let adaptive quality change settings during the run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='json report path, stdout when left out')
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as infile:
+            script = json.load(infile)
+    if args.frames:
+        script = dict(script, frames=args.frames)
+
+    replay = Replay(args.replay) if args.replay else None
+    report = run(script, tuple(int(n) for n in args.size.split('x')), args.fps, args.warmup, args.adaptive, args.seed, replay)
+    if args.out:
+        with open(args.out, 'w') as outfile:
+            json.dump(report, outfile, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
@@ -0,0 +1,57 @@
+INF = float('inf')
+
+def merge_cells(is_solid, left, top, width, height, tile_size):
+    # greedy merge: horizontal runs per row, then runs with the same span grow downwards
+    rects = []
+    open_runs = {}
+    for y in range(top, top + height + 1):
+        runs = set()
+        if y < top + height:
+            x = left
+            while x < left + width:
+                if is_solid(x, y):
+                    start = x
+                    while x < left + width and is_solid(x, y):
+                        x += 1
+                    runs.add((start, x))
+                x += 1
+
+        for run in list(open_runs):
+            if run not in runs:
+                run_top = open_runs.pop(run)
+                rects.append((run[0] * tile_size, run_top * tile_size, (run[1] - run[0]) * tile_size, (y - run_top) * tile_size))
+        for run in runs:
+            open_runs.setdefault(run, y)
+    return rects
+
+def sweep_aabb(rect, dx, dy, other):
+    # time of impact in [0, 1) of rect moving by (dx, dy) against other, with the contact normal
+    x, y, w, h = rect
+    ox, oy, ow, oh = other
+
+    if dx > 0:
+        x_entry, x_exit = (ox - (x + w)) / dx, (ox + ow - x) / dx
+    elif dx < 0:
+        x_entry, x_exit = (ox + ow - x) / dx, (ox - (x + w)) / dx
+    elif x + w <= ox or x >= ox + ow:
+        return None
+    else:
+        x_entry, x_exit = -INF, INF
+
+    if dy > 0:
+        y_entry, y_exit = (oy - (y + h)) / dy, (oy + oh - y) / dy
+    elif dy < 0:
+        y_entry, y_exit = (oy + oh - y) / dy, (oy - (y + h)) / dy
+    elif y + h <= oy or y >= oy + oh:
+        return None
+    else:
+        y_entry, y_exit = -INF, INF
+
+    entry = max(x_entry, y_entry)
+    # already overlapping (entry < 0) is left alone so entities can never get stuck inside a tile
+    if entry > min(x_exit, y_exit) or entry < 0 or entry >= 1:
+        return None
+
+    if x_entry > y_entry:
+        return entry, (-1 if dx > 0 else 1), 0
+    return entry, 0, (-1 if dy > 0 else 1)
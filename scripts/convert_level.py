@@ -0,0 +1,13 @@
+import sys
+
+from scripts.tilemap import Tilemap
+
+# python -m scripts.convert_level data/levels/map.json data/levels/map.lvl
+# the direction follows the file extensions, so .lvl -> .json works the same way
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m scripts.convert_level <source> <destination>')
+
+    tilemap = Tilemap()
+    tilemap.load(sys.argv[1])
+    tilemap.save(sys.argv[2])
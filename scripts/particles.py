@@ -3,6 +3,8 @@ import random
 
 import pygame
 
+from scripts.assets import assets
+
 global e_colorkey
 e_colorkey = (0, 0, 0)
 global particle_images
@@ -37,9 +39,7 @@ def load_particle_images(path):
         img_list = particle_file_sort(img_list)
         images = []
         for img in img_list:
-            images.append(pygame.image.load(path + '/' + folder + '/' + img).convert())
-        for img in images:
-            img.set_colorkey(e_colorkey)
+            images.append(assets.image(path + '/' + folder + '/' + img, e_colorkey))
         particle_images[folder] = images.copy()
 
 
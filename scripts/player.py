@@ -1,11 +1,18 @@
 import pygame
-from scripts.tilemap import AnimBlock
+from scripts.assets import assets
+from scripts.utils import get_ticks
+from scripts.tilemap import AnimBlock, LETHAL, BOUNCE, END, SPREADING, INACTIVE_CHECKPOINT, ACTIVE_CHECKPOINT
+
+# contact normal from Tilemap.sweep -> side of the entity that touched
+NORMAL_SIDES = {(-1, 0): 'right', (1, 0): 'left', (0, -1): 'down', (0, 1): 'up'}
 
 class PhysicsEntity():
     def __init__(self, game, e_type, pos, size):
         self.game = game
         self.type = e_type
         self.pos = list(pos)
+        # position after the previous simulation step, rendering interpolates from it
+        self.prev_pos = list(pos)
         self.size = size
         self.velocity = [0, 0]
         self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
@@ -25,35 +32,16 @@ class PhysicsEntity():
     def set_action(self, action):
         if action != self.action:
             self.action = action
-            self.animation = self.game.animations[self.type + '/' + self.action].copy()
+            self.animation = self.game.animations[self.type + '/' + self.action].play()
             
     def update(self, tilemap, movement=(0, 0)):
+        self.prev_pos = list(self.pos)
         self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
         frame_movement = (movement[0] + self.velocity[0], movement[1] + self.velocity[1])
         
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
-                    entity_rect.right = rect.left
-                    self.collisions['right'] = True
-                if frame_movement[0] < 0:
-                    entity_rect.left = rect.right
-                    self.collisions['left'] = True
-                self.pos[0] = entity_rect.x
-        
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions['down'] = True
-                if frame_movement[1] < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions['up'] = True
-                self.pos[1] = entity_rect.y
+        self.pos[0], self.pos[1], normals = tilemap.sweep((self.pos[0], self.pos[1], self.size[0], self.size[1]), frame_movement)
+        for normal in normals:
+            self.collisions[NORMAL_SIDES[normal]] = True
                 
         if movement[0] > 0:
             self.flip = False
@@ -69,9 +57,16 @@ class PhysicsEntity():
         
         self.animation.update()
     
-    def render(self, surf, offset=(0, 0)):
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False), 
-                  (self.pos[0] - offset[0] + self.anim_offset[0], self.pos[1] - offset[1] + self.anim_offset[1] + 2))
+    def render_pos(self, alpha=1):
+        # alpha is how far the frame lies between the previous and the current step
+        return (self.prev_pos[0] + (self.pos[0] - self.prev_pos[0]) * alpha,
+                self.prev_pos[1] + (self.pos[1] - self.prev_pos[1]) * alpha)
+
+    def render(self, surf, offset=(0, 0), alpha=1):
+        pos = self.render_pos(alpha)
+        surf.blit(self.animation.img(self.flip), 
+                  (pos[0] - offset[0] + self.anim_offset[0], pos[1] - offset[1] + self.anim_offset[1] + 2))
+
 class Player(PhysicsEntity):
     def __init__(self, game, pos, size):
         super().__init__(game, 'player', pos, size)
@@ -93,14 +88,14 @@ class Player(PhysicsEntity):
         
         # SOunds
         self.sounds = {
-            'jump': pygame.mixer.Sound('data/sounds/jump.mp3'),
-            'death': pygame.mixer.Sound('data/sounds/death.mp3'),
-            'land': pygame.mixer.Sound('data/sounds/land.mp3' ),
-            'dash': pygame.mixer.Sound('data/sounds/dash.mp3'),
-            'anomaly_0': pygame.mixer.Sound('data/sounds/anomaly_0.mp3'),
-            'anomaly_1': pygame.mixer.Sound('data/sounds/anomaly_1.mp3'),
-            'checkpoint': pygame.mixer.Sound('data/sounds/checkpoint.mp3'),
-            'run': pygame.mixer.Sound('data/sounds/run.mp3')
+            'jump': assets.sound('data/sounds/jump.mp3'),
+            'death': assets.sound('data/sounds/death.mp3'),
+            'land': assets.sound('data/sounds/land.mp3'),
+            'dash': assets.sound('data/sounds/dash.mp3'),
+            'anomaly_0': assets.sound('data/sounds/anomaly_0.mp3'),
+            'anomaly_1': assets.sound('data/sounds/anomaly_1.mp3'),
+            'checkpoint': assets.sound('data/sounds/checkpoint.mp3'),
+            'run': assets.sound('data/sounds/run.mp3')
         }
         
         self.sounds['run'].set_volume(0.15) 
@@ -130,20 +125,20 @@ class Player(PhysicsEntity):
             super().update(tilemap)
             return
         
-        for tile in tilemap.tiles_around(self.pos, '|'):
-            if tile['tile_id'] == '139':
-                self.velocity[1] = -2
-                self.velocity[0] = 0
-                movement = [False,False]
-                self.set_action('fall')
-                
-            if tile['tile_id'] == '140':
-                self.death = True
-                self.game.transition_vfx['value'] = 39
-                self.game.death_vfx_timer = 0 
-                self.game.scenes['sub_scene'] = 'ending'
-                
         super().update(tilemap, movement=movement)
+        flags, checkpoint, contact = tilemap.triggers(self.pos, self.size, self.collisions)
+
+        if flags & BOUNCE:
+            self.velocity[1] = -2
+            self.velocity[0] = 0
+            movement = [False,False]
+            self.set_action('fall')
+            
+        if flags & END:
+            self.death = True
+            self.game.transition_vfx['value'] = 39
+            self.game.death_vfx_timer = 0 
+            self.game.scenes['sub_scene'] = 'ending'
 
         self.air_time += 1
         last_direction = None 
@@ -153,75 +148,41 @@ class Player(PhysicsEntity):
             
         #print(self.pos)
             
-        for tile in tilemap.tiles_around(self.pos, ':'):
-            if tile['tile_id'] == '110':
-                self.game.checkpoint = [tile['pos'][0] * tilemap.tile_size, tile['pos'][1] * tilemap.tile_size]
-                
-                tilemap.tilemap[str(tile['pos'][0]) + ':' + str(tile['pos'][1])]['tile_id'] = '111'
-                self.sounds['checkpoint'].play()
-                
-                for key, tile_ in tilemap.tilemap.items():
-                    if tile != tile_ and tile_['tile_id'] == '111':
-                        tile_['tile_id'] = '110'
+        if checkpoint:
+            self.game.checkpoint = [checkpoint[0] * tilemap.tile_size, checkpoint[1] * tilemap.tile_size]
+            
+            tilemap.set_tile('decoration', checkpoint[0], checkpoint[1], ACTIVE_CHECKPOINT)
+            self.sounds['checkpoint'].play()
+            
+            for layer, x, y in tilemap.find_tiles(ACTIVE_CHECKPOINT):
+                if (layer, (x, y)) != ('decoration', checkpoint):
+                    tilemap.set_tile(layer, x, y, INACTIVE_CHECKPOINT)
 
+        if flags & LETHAL:
+            self.death = True
+            self.game.transition_vfx['value'] = 39
+            self.game.death_vfx_timer = 0 
+            return
 
         for direction in ['down', 'up', 'left', 'right']:
             if self.collisions[direction]:
-                check_pos = [self.pos[:], self.pos[:]]
-
-                if direction == 'down':
-                    check_pos[0][1] += self.size[1]
-                    check_pos[1][1] += self.size[1]
-                    check_pos[1][0] += self.size[0]
-                    
-                elif direction == 'up':
-                    check_pos[0][1] -= 1
-                    check_pos[1][1] -= 1
-                    check_pos[1][0] += self.size[0]
-                    
-                elif direction == 'left':
-                    check_pos[0][0] -= 1
-                    check_pos[1][0] -= 1
-                    check_pos[1][1] += self.size[1]
-                    
-                elif direction == 'right':
-                    check_pos[0][0] += self.size[0] + 1
-                    check_pos[1][0] += self.size[0] + 1
-                    check_pos[1][1] += self.size[1]
-
-                self.tile = [tilemap.solid_check(check_pos[0]), tilemap.solid_check(check_pos[1])]
+                self.tile = contact
                 self.last_collision_direction = direction
-                
-                #print(tilemap.solid_check(check_pos[0]))
-
-                if self.tile[0] and self.tile[1]:
-                    if self.tile[0]['tile_id'] in ['10', '22', '77', '78'] or self.tile[1]['tile_id'] in ['10', '22', '77', '78']:
-                        self.death = True
-                        self.game.transition_vfx['value'] = 39
-                        self.game.death_vfx_timer = 0 
-                        return
-
-        for direction in ['down', 'up', 'left', 'right']:
-            if self.collisions[direction]:
                 if last_direction is None:
                     last_direction = direction
 
-        if self.last_tile and self.last_tile[0]:
+        if self.last_tile:
+            original_pos = self.last_tile[1]
            
-            if (self.last_tile[0]['tile_id'] == '44' and self.last_tile[0] != self.tile[0]) or (self.last_tile[0]['tile_id'] == '44' and self.velocity[1] <= -2.5):
-                original_pos = self.last_tile[0]['pos'].copy()
-                tile_loc = f"{original_pos[0]};{original_pos[1]}"
-                if tile_loc in tilemap.tilemap:
-                    tilemap.tilemap[tile_loc]['tile_id'] = '22'
+            if tilemap.flags[tilemap.get_tile('physics', *original_pos)] & SPREADING and (self.last_tile != self.tile or self.velocity[1] <= -2.5):
+                tilemap.set_tile('physics', original_pos[0], original_pos[1], 22)
 
                 directions = [(0, -1, 0), (0, 1, 180), (1, 0, 270), (-1, 0, 90)]
                 for dx, dy, dir_angle in directions:
                     check_pos = (original_pos[0] + dx, original_pos[1] + dy)
-                    check_loc = f"{check_pos[0]}|{check_pos[1]}"
                     if not tilemap.tile_exists(check_pos[0], check_pos[1]):
-                        tilemap.tilemap[check_loc] = {'tile_id': '17', 'pos': list(check_pos)}
-                        self.game.map['rotatesset'][check_loc] = dir_angle
-                        self.anim_blocks.append(AnimBlock(self.game, check_pos, dir_angle, self.game.animations['danger_block/create'].copy()))
+                        tilemap.set_tile('background', check_pos[0], check_pos[1], 17, rotation=dir_angle)
+                        self.anim_blocks.append(AnimBlock(self.game, check_pos, dir_angle, self.game.animations['danger_block/create'].play()))
 
         self.last_tile = self.tile
 
@@ -270,8 +231,8 @@ class Player(PhysicsEntity):
             if self.collisions['down'] and movement[0] == 0:
                 left_point = (self.pos[0], self.pos[1] + self.size[1] + 1)
                 right_point = (self.pos[0] + self.size[0], self.pos[1] + self.size[1] + 1)
-                left_has_tile = any(rect.collidepoint(left_point) for rect in tilemap.physics_rects_around(self.pos))
-                right_has_tile = any(rect.collidepoint(right_point) for rect in tilemap.physics_rects_around(self.pos))
+                left_has_tile = tilemap.solid_check(left_point)
+                right_has_tile = tilemap.solid_check(right_point)
                 self.on_edge = not (left_has_tile and right_has_tile)
 
         if not self.wall_slide and self.land_timer == 0:
@@ -284,7 +245,7 @@ class Player(PhysicsEntity):
                 self.set_action('run')
                 self.on_edge = False
 
-                current_time = pygame.time.get_ticks() / 1000  
+                current_time = get_ticks() / 1000  
                 if current_time - self.last_run_sound_time >= self.run_sound_duration:
                     self.left_channel_bust.play(self.sounds['run'])
                     self.last_run_sound_time = current_time 
@@ -300,9 +261,6 @@ class Player(PhysicsEntity):
                 self.velocity[0] = max(self.velocity[0] - 0.1, 0)
             else:
                 self.velocity[0] = min(self.velocity[0] + 0.1, 0)
-                
-        for anim in self.anim_blocks:
-            anim.render(self.game.displays['main'], offset=self.game.render_scroll)
             
     def jump(self, jump_power=0):
         if self.wall_slide:
@@ -335,12 +293,16 @@ class Player(PhysicsEntity):
         self.left_channel_bust.play(self.sounds['dash'])
         return True
     
-    def render(self, surf, offset=(0, 0)):
+    def render(self, surf, offset=(0, 0), alpha=1):
+        if not self.death:
+            for anim in self.anim_blocks:
+                anim.render(surf, offset=offset)
+
         if self.death and self.animation.done:
             return 
         
         def process_sprite(color_map):
-            sprite = self.animation.img()
+            sprite = self.animation.img(self.flip)
             sprite_copy = sprite.copy()
             width, height = sprite_copy.get_size()
             for x in range(width):
@@ -355,9 +317,10 @@ class Player(PhysicsEntity):
         for buff, color_map in color_maps.items():
             if buff in self.buffs:
                 processed_sprite = process_sprite(color_map)
-                surf.blit(pygame.transform.flip(processed_sprite, self.flip, False),
-                          (self.pos[0] - offset[0] + self.anim_offset[0],
-                           self.pos[1] - offset[1] + self.anim_offset[1] + 2))
+                pos = self.render_pos(alpha)
+                surf.blit(processed_sprite,
+                          (pos[0] - offset[0] + self.anim_offset[0],
+                           pos[1] - offset[1] + self.anim_offset[1] + 2))
                 return
 
-        super().render(surf, offset=offset)
\ No newline at end of file
+        super().render(surf, offset=offset, alpha=alpha)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import time
+from collections import deque
+
+import pygame
+
+from scripts.text import render_text, glyph_atlas
+
+# stages of a game frame with their colour in the graph
+STAGES = {
+    'events': (90, 90, 255),
+    'tilemap': (60, 200, 90),
+    'particles': (230, 200, 60),
+    'player': (240, 120, 40),
+    'ui': (200, 80, 220),
+    'upload': (60, 210, 230),
+    'shader': (240, 60, 60),
+}
+
+class FrameTimer:
+    # splits every frame into stages: mark(stage) charges the time since the previous mark to it.
+    # the last window frames of every stage are kept for the percentiles and the graph
+    def __init__(self, stages=STAGES, window=240, refresh=15):
+        self.stages = stages
+        self.history = {stage: deque(maxlen=window) for stage in stages}
+        self.current = dict.fromkeys(stages, 0.0)
+        self.last = time.perf_counter()
+        self.frames = 0
+        # the overlay only repaints every refresh frames
+        self.refresh = refresh
+        self.visible = False
+        self.shown = None
+
+    def begin(self):
+        # the wait for the frame cap before this is not charged to any stage
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.current[stage] += (now - self.last) * 1000
+        self.last = now
+
+    def end(self):
+        # returns the time charged to the frame, in ms
+        for stage, ms in self.current.items():
+            self.history[stage].append(ms)
+        work = sum(self.current.values())
+        self.current = dict.fromkeys(self.stages, 0.0)
+        self.frames += 1
+        return work
+
+    def totals(self):
+        return [sum(frame) for frame in zip(*self.history.values())]
+
+    def percentile(self, p, stage=None):
+        # p in [0, 100] of one stage, or of whole frames without a stage
+        times = sorted(self.history[stage] if stage else self.totals())
+        if not times:
+            return 0.0
+        return times[min(len(times) - 1, int(len(times) * p / 100))]
+
+    def report(self, percentiles=(50, 95, 99)):
+        stats = {stage: {'p%d' % p: round(self.percentile(p, stage), 3) for p in percentiles} for stage in self.stages}
+        stats['frame'] = {'p%d' % p: round(self.percentile(p), 3) for p in percentiles}
+        return stats
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.shown = None
+
+    def update(self):
+        # takes a snapshot every refresh frames; returns the state the overlay is drawn from
+        bucket = self.frames // self.refresh
+        if not self.shown or self.shown[0] != bucket:
+            frame = self.percentile(50)
+            summary = '%d fps  %.1f ms p95' % (1000 / frame if frame else 0, self.percentile(95))
+            rows = [(stage, color, [self.percentile(p, stage) for p in (50, 95, 99)]) for stage, color in self.stages.items()]
+            rows.append(('frame', (255, 255, 255), [self.percentile(p) for p in (50, 95, 99)]))
+            graph = list(zip(*self.history.values())) if self.visible else []
+            self.shown = (bucket, summary, rows, graph)
+        return (self.visible, bucket)
+
+    def bounds(self, font, right=950, top=10):
+        if self.visible:
+            rect = pygame.Rect(0, top, self.history['events'].maxlen + 16, 112 + len(self.shown[2]) * font.get_linesize())
+        else:
+            rect = pygame.Rect((0, top), glyph_atlas(font, (255, 255, 255)).size(self.shown[1]))
+        rect.right = right
+        return rect
+
+    def draw(self, surf, font, rect, budget=1000 / 60):
+        bucket, summary, rows, frames = self.shown
+        if not self.visible:
+            glyph_atlas(font, (255, 255, 255)).draw(surf, summary, rect.topleft)
+            return
+
+        pygame.draw.rect(surf, (12, 12, 12), rect)
+        graph = pygame.Rect(rect.x + 8, rect.y + 8, rect.width - 16, 96)
+        # the graph is two frame budgets tall, frames above that are cut off
+        scale = graph.height / (budget * 2)
+
+        for i, frame in enumerate(frames):
+            y = graph.bottom
+            for ms, color in zip(frame, self.stages.values()):
+                height = ms * scale
+                if height >= 1:
+                    pygame.draw.line(surf, color, (graph.x + i, y), (graph.x + i, max(graph.y, y - height)))
+                y -= height
+        budget_y = graph.bottom - budget * scale
+        pygame.draw.line(surf, (255, 255, 255), (graph.x, budget_y), (graph.right, budget_y))
+
+        y = graph.bottom + 8
+        for name, color, times in rows:
+            surf.blit(render_text(font, name, color), (graph.x, y))
+            digits = glyph_atlas(font, color)
+            for i, ms in enumerate(times):
+                text = '%.1f' % ms
+                digits.draw(surf, text, (graph.x + 120 + i * 40 - digits.size(text)[0], y))
+            y += font.get_linesize()
@@ -0,0 +1,54 @@
+from collections import deque
+
+# (render scale, shader quality) from best to cheapest
+QUALITY_STEPS = [(1.0, 2), (0.75, 2), (0.75, 1), (0.5, 1), (0.5, 0)]
+
+class AdaptiveQuality:
+    # steps the shader down while recent frames run over budget and back up after a calm stretch
+    def __init__(self, shader, budget=15.0, window=30, recover=180, headroom=0.6):
+        self.shader = shader
+        self.budget = budget
+        self.times = deque(maxlen=window)
+        self.recover = recover
+        self.headroom = headroom
+        self.calm = 0
+        self.step = 0
+        # gpu time of the post-processing; two queries take turns so the one read back is a frame old
+        # and has finished, nothing waits on the gpu
+        self.queries = [shader.ctx.query(time=True) for i in range(2)]
+        self.frame = 0
+        self.apply()
+
+    def release(self):
+        for query in self.queries:
+            query.release()
+
+    def gpu_timer(self):
+        return self.queries[self.frame % 2]
+
+    def apply(self):
+        self.shader.render_scale, self.shader.quality = QUALITY_STEPS[self.step]
+        self.times.clear()
+        self.calm = 0
+
+    def update(self, cpu_ms):
+        # cpu_ms is the time spent working on the frame without the vsync wait in flip or the wait for the
+        # frame cap; the frame costs whichever of it and the last frame's gpu time is longer
+        gpu_ms = self.queries[(self.frame + 1) % 2].elapsed / 1000000 if self.frame else 0
+        self.frame += 1
+        self.times.append(max(cpu_ms, gpu_ms))
+        if len(self.times) < self.times.maxlen:
+            return
+
+        average = sum(self.times) / len(self.times)
+        if average > self.budget:
+            if self.step < len(QUALITY_STEPS) - 1:
+                self.step += 1
+                self.apply()
+        elif average < self.budget * self.headroom:
+            self.calm += 1
+            if self.calm >= self.recover and self.step:
+                self.step -= 1
+                self.apply()
+        else:
+            self.calm = 0
@@ -0,0 +1,115 @@
+"""Records the game scene's input and frame times and plays them back.
+
+A recording starts from Game.state(), the seed, the game clock and the held movement keys. That is not the
+whole simulation: player velocity, action, dash and buffs, skill cooldowns and the effect timers are left out,
+and a replay rebuilds them fresh through load_state. A recording therefore has to start while all of that is
+at rest, as it is when the game scene is entered from a freshly loaded level; Recording checks this.
+"""
+import json
+import random
+import struct
+import zlib
+
+import pygame
+
+from scripts.utils import get_ticks, set_ticks
+
+# header: magic, version, length of the zlib compressed json start state
+MAGIC = b'WJBR'
+VERSION = 1
+HEADER = struct.Struct('<4sBI')
+# frame: frame time in ms, number of input bytes that follow
+FRAME = struct.Struct('<HB')
+
+# the keys the game scene reacts to; an input byte is the index here, with the top bit set for a press
+KEYS = [pygame.K_a, pygame.K_d, pygame.K_w, pygame.K_q, pygame.K_e, pygame.K_f, pygame.K_0, pygame.K_F3]
+PRESSED = 0x80
+QUIT = 0x7f
+
+def at_rest(game):
+    # true while everything Game.state() leaves out still has the values a freshly loaded level gives it
+    player = game.player
+    return (player.velocity == [0, 0] and not player.buffs and not player.dashing and not player.anim_blocks
+            and not game.particles and not game.death_vfx_timer
+            and not game.screenshot_vfx['enabled'] and not game.anomaly_text_vfx['enabled']
+            and not any(skill.kd_time for skill in game.ui.values()))
+
+class Recording:
+    # logs the time and input of every game frame, starting from the state and seed the scene was entered with
+    def __init__(self, path, game):
+        assert at_rest(game), 'a recording has to start from a freshly loaded level, see the module docstring'
+        self.path = path
+        self.seed = random.randrange(2 ** 32)
+        random.seed(self.seed)
+        # serialized right away, the state holds lists the game keeps changing
+        self.start = zlib.compress(json.dumps({
+            'seed': self.seed,
+            'ticks': get_ticks(),
+            'movement': list(game.movement),
+            'state': game.state(),
+        }).encode())
+        self.frames = bytearray()
+
+    def add(self, frame_time, events):
+        # returns the frame time as it will be replayed, whole ms
+        ms = min(0xffff, round(frame_time * 1000))
+        inputs = bytearray()
+        for event in events:
+            if event.type == pygame.QUIT:
+                inputs.append(QUIT)
+            elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in KEYS:
+                inputs.append(KEYS.index(event.key) | (PRESSED if event.type == pygame.KEYDOWN else 0))
+        # more than 255 inputs in one frame are not a person playing
+        inputs = inputs[:0xff]
+        self.frames += FRAME.pack(ms, len(inputs)) + inputs
+        return ms / 1000
+
+    def save(self):
+        with open(self.path, 'wb') as outfile:
+            outfile.write(HEADER.pack(MAGIC, VERSION, len(self.start)))
+            outfile.write(self.start)
+            outfile.write(self.frames)
+
+class Replay:
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            data = infile.read()
+
+        magic, version, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + ' is not a version %d recording' % VERSION)
+        self.start = json.loads(zlib.decompress(data[HEADER.size:HEADER.size + length]))
+
+        self.frames = []
+        offset = HEADER.size + length
+        while offset < len(data):
+            ms, count = FRAME.unpack_from(data, offset)
+            offset += FRAME.size
+            self.frames.append((ms / 1000, data[offset:offset + count]))
+            offset += count
+        self.frame = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def restore(self, game):
+        game.load_state(self.start['state'])
+        game.movement = list(self.start['movement'])
+        set_ticks(self.start['ticks'])
+        random.seed(self.start['seed'])
+        self.frame = 0
+
+    def next_frame(self):
+        # (frame time, events) of the next frame, None once the recording is over
+        if self.frame >= len(self.frames):
+            return None
+        frame_time, inputs = self.frames[self.frame]
+        self.frame += 1
+
+        events = []
+        for code in inputs:
+            if code == QUIT:
+                events.append(pygame.event.Event(pygame.QUIT))
+            else:
+                events.append(pygame.event.Event(pygame.KEYDOWN if code & PRESSED else pygame.KEYUP, key=KEYS[code & ~PRESSED]))
+        return frame_time, events
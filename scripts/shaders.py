@@ -1,13 +1,103 @@
 from array import array
+import hashlib
+import os
+import time
 import moderngl
+import pygame
 
 BASE_PATH = 'shaders/'
+
+# composited bottom to top
+SCENE_LAYERS = ['particles', 'background', 'physics', 'entities', 'decoration']
+
+def frame_size(frame):
+    return frame.size if isinstance(frame, moderngl.Texture) else frame.get_size()
+
+def read_source(name, kind):
+    return open(BASE_PATH + name + '.' + kind, 'r').read()
+
+class ShaderProgram:
+    # a program and its vertex array; the manager swaps both in place when the sources change
+    def __init__(self, vert_path, frag_path, content):
+        self.paths = (vert_path, frag_path)
+        self.content = content
+        self.key = None
+        self.program = None
+        self.vao = None
+
+    def __getitem__(self, name):
+        return self.program[name]
+
+    def render(self, mode=moderngl.TRIANGLE_STRIP, instances=1):
+        self.vao.render(mode=mode, instances=instances)
+
+class ShaderManager:
+    # compiles every distinct vertex + fragment source once, keyed by its hash. moderngl cannot build a
+    # program from a binary, so the cache lives as long as the context. with watch on, edited files under
+    # BASE_PATH are recompiled while the game runs and a failed compile keeps the last good program
+    def __init__(self, ctx, watch=False, interval=0.5):
+        self.ctx = ctx
+        self.cache = {}
+        self.loaded = []
+        self.watch = watch
+        self.interval = interval
+        self.last_check = 0
+        self.mtimes = self.scan()
+
+    def compile(self, vert, frag):
+        key = hashlib.sha1((vert + '\0' + frag).encode()).hexdigest()
+        if key not in self.cache:
+            self.cache[key] = self.ctx.program(vertex_shader=vert, fragment_shader=frag)
+        return key, self.cache[key]
+
+    def load(self, vert_path, frag_path, content):
+        program = ShaderProgram(vert_path, frag_path, content)
+        self.swap(program, *self.compile(read_source(vert_path, 'vert'), read_source(frag_path, 'frag')))
+        self.loaded.append(program)
+        return program
+
+    def unload(self, program):
+        # the compiled program stays cached for whoever loads the same sources next
+        self.loaded.remove(program)
+        if program.vao:
+            program.vao.release()
+            program.vao = None
+
+    def swap(self, program, key, compiled):
+        if key == program.key:
+            return
+        vao = self.ctx.vertex_array(compiled, program.content)
+        if program.vao:
+            program.vao.release()
+        program.key = key
+        program.program = compiled
+        program.vao = vao
+
+    def reload(self):
+        for program in self.loaded:
+            try:
+                self.swap(program, *self.compile(read_source(program.paths[0], 'vert'), read_source(program.paths[1], 'frag')))
+            except (moderngl.Error, KeyError, OSError, UnicodeDecodeError) as error:
+                print("Warning: keeping the previous " + '/'.join(program.paths) + " shader, it failed to build:", error)
+
+    def scan(self):
+        return {name: os.stat(BASE_PATH + name).st_mtime for name in os.listdir(BASE_PATH)}
+
+    def poll(self):
+        if not self.watch or time.monotonic() - self.last_check < self.interval:
+            return
+        self.last_check = time.monotonic()
+        mtimes = self.scan()
+        if mtimes != self.mtimes:
+            self.mtimes = mtimes
+            self.reload()
+
 class Shader:
-    def __init__(self, vert_path, frag_paths):
-        self.vert = open(BASE_PATH + vert_path + '.vert', 'r').read()
-        self.frag_shaders = [open(BASE_PATH + frag_path + '.frag', 'r').read() for frag_path in frag_paths]
-        
-        self.ctx = moderngl.create_context()
+    def __init__(self, vert_path, frag_paths, letterbox=False, watch=False, ctx=None):
+        # a standalone ctx draws into whatever framebuffer it has bound instead of the window
+        self.ctx = ctx or moderngl.create_context()
+        self.standalone = ctx is not None
+        self.manager = ShaderManager(self.ctx, watch)
 
         self.quad_buffer = self.ctx.buffer(data=array('f', [
             -1.0, 1.0, 0.0, 0.0,
@@ -16,35 +106,159 @@ class Shader:
             1.0, -1.0, 1.0, 1.0,
         ]))
 
-        self.programs = [
-            self.ctx.program(vertex_shader=self.vert, fragment_shader=frag)
-            for frag in self.frag_shaders
-        ]
-        
-        self.render_objects = [
-            self.ctx.vertex_array(program, [(self.quad_buffer, '2f 2f', 'vert', 'texcoord')])
-            for program in self.programs
-        ]
+        quad = [(self.quad_buffer, '2f 2f', 'vert', 'texcoord')]
+        self.programs = [self.manager.load(vert_path, frag_path, quad) for frag_path in frag_paths]
         
         self.current_shader = 0
+
+        # frames are uploaded at their own size and scaled up here; letterbox keeps the scale a whole number
+        self.letterbox = letterbox
+
+        # post-processing runs at render_scale of the screen and is stretched up by the present pass;
+        # quality is handed to the shaders (2 everything, 1 no per-pixel noise, 0 no scanlines or vignette)
+        self.render_scale = 1.0
+        self.quality = 2
+        self.present_program = self.manager.load(vert_path, 'present', quad)
+        self.post = None
+        self.post_fbo = None
+
+        # stacks the native resolution layers into one scene texture before post-processing
+        self.composite_program = self.manager.load(vert_path, 'composite', quad)
+        self.scene = None
+        self.scene_fbo = None
+        self.scene_layers = None
+        # stands in for layers that are not drawn this frame
+        self.blank = self.ctx.texture((1, 1), 4, bytes(4))
+
+        # transition, flash and death overlays drawn over the finished frame, set again every frame
+        self.overlay_program = self.manager.load(vert_path, 'overlay', quad)
+        self.overlay = None
+
+        # long-lived textures by name, each fed through two pixel buffers used in turn
+        self.textures = {}
+        self.pixel_buffers = {}
     
-    def surf_to_texture(self, surf):
-        tex = self.ctx.texture(surf.get_size(), 4)
-        tex.filter = (moderngl.NEAREST, moderngl.NEAREST)
-        tex.swizzle = 'BGRA'
-        tex.write(surf.get_view('1'))
+    def upload(self, name, surf, rects=None):
+        # the pixel buffer written now is not the one the driver may still be copying from last frame,
+        # so the write never waits on the gpu; textures are only reallocated when the size changes.
+        # with rects only those areas are written, an empty list keeps last frame's texture as it is
+        size = surf.get_size()
+        tex = self.textures.get(name)
+        if tex and tex.size == size and rects is not None and surf.get_rect() not in rects:
+            for rect in rects:
+                tex.write(pygame.image.tobytes(surf.subsurface(rect), 'BGRA'), viewport=tuple(rect))
+            return tex
+
+        if not tex or tex.size != size:
+            if tex:
+                tex.release()
+                for buffer in self.pixel_buffers[name][0]:
+                    buffer.release()
+            tex = self.textures[name] = self.ctx.texture(size, 4)
+            tex.filter = (moderngl.NEAREST, moderngl.NEAREST)
+            tex.swizzle = 'BGRA'
+            self.pixel_buffers[name] = [[self.ctx.buffer(reserve=size[0] * size[1] * 4) for i in range(2)], 0]
+
+        buffers, current = self.pixel_buffers[name]
+        buffers[current].write(surf.get_view('1'))
+        tex.write(buffers[current])
+        self.pixel_buffers[name][1] = 1 - current
         return tex
 
+    def composite(self, layers, changed=None):
+        # layers maps SCENE_LAYERS names to a surface, a texture or None. surfaces are only uploaded again
+        # when named in changed, and the scene is only recomposed when something changed
+        changed = set(layers) if changed is None else set(changed)
+        textures = {}
+        for name in SCENE_LAYERS:
+            layer = layers.get(name)
+            if layer is None:
+                textures[name] = self.blank
+            elif isinstance(layer, moderngl.Texture):
+                textures[name] = layer
+            elif name in changed or name not in self.textures:
+                textures[name] = self.upload(name, layer)
+            else:
+                textures[name] = self.textures[name]
+
+        size = max(texture.size for texture in textures.values())
+        if self.scene and self.scene.size == size and textures == self.scene_layers and not changed:
+            return self.scene
+        self.scene_layers = textures
+
+        if not self.scene or self.scene.size != size:
+            if self.scene:
+                self.scene_fbo.release()
+                self.scene.release()
+            self.scene = self.ctx.texture(size, 4)
+            self.scene.filter = (moderngl.NEAREST, moderngl.NEAREST)
+            self.scene_fbo = self.ctx.framebuffer(color_attachments=[self.scene])
+
+        for unit, name in enumerate(SCENE_LAYERS):
+            textures[name].use(unit)
+            self.composite_program[name].value = unit
+
+        target = self.ctx.fbo
+        self.scene_fbo.use()
+        self.composite_program.render()
+        target.use()
+        return self.scene
+
+    def viewport(self, size):
+        width, height = self.ctx.fbo.size
+        if not self.letterbox:
+            return (0, 0, width, height)
+
+        scale = max(1, min(width // size[0], height // size[1]))
+        return ((width - size[0] * scale) // 2, (height - size[1] * scale) // 2, size[0] * scale, size[1] * scale)
+
+    def to_frame(self, pos, size):
+        # window position (top-left origin) -> position on a frame of this size
+        x, y, w, h = self.viewport(size)
+        top = self.ctx.fbo.size[1] - y - h
+        return (int((pos[0] - x) * size[0] / w), int((pos[1] - top) * size[1] / h))
+
+    def set_overlay(self, fill=(0, 0, 0), radius=None, flash=None):
+        # radius in ui pixels keeps a hole open in the middle, flash is the white alpha 0-255 over the fill
+        self.overlay = (fill, radius, flash)
+
     def set_shader(self, index=0):
         if 0 <= index < len(self.programs):
             self.current_shader = index
         else:
             raise ValueError("Invalid shader index")
 
-    def render(self, t, surf=None, ui_surf=None, noise_cof=1):
-        
+    def post_target(self, viewport):
+        size = (max(1, int(viewport[2] * self.render_scale)), max(1, int(viewport[3] * self.render_scale)))
+        if not self.post or self.post.size != size:
+            if self.post:
+                self.post_fbo.release()
+                self.post.release()
+            self.post = self.ctx.texture(size, 4)
+            self.post.filter = (moderngl.LINEAR, moderngl.LINEAR)
+            self.post_fbo = self.ctx.framebuffer(color_attachments=[self.post])
+        return self.post_fbo
+
+    def render(self, t, surf=None, ui_surf=None, noise_cof=1, ui_rects=None):
+        self.manager.poll()
+        size = frame_size(surf or ui_surf)
+        screen = self.ctx.fbo
+        if self.letterbox:
+            self.ctx.viewport = (0, 0, *screen.size)
+            self.ctx.clear(0.0, 0.0, 0.0)
+        viewport = self.viewport(size)
+
+        if self.render_scale < 1:
+            self.post_target(viewport).use()
+        else:
+            self.ctx.viewport = viewport
+
+        for program in self.programs[:2]:
+            if 'quality' in program.program:
+                program['quality'].value = self.quality
+
         if surf:
-            frame_tex = self.surf_to_texture(surf)
+            frame_tex = surf if isinstance(surf, moderngl.Texture) else self.upload('frame', surf)
             frame_tex.use(1)
 
             program = self.programs[0]
@@ -53,13 +267,11 @@ class Shader:
             program['time'].value = t
             program['noise_cof'].value = noise_cof
             
-            self.render_objects[0].render(mode=moderngl.TRIANGLE_STRIP)
-            
-            frame_tex.release()
+            program.render()
         
         if ui_surf:
         
-            ui_tex = self.surf_to_texture(ui_surf)
+            ui_tex = self.upload('ui', ui_surf, ui_rects)
             ui_tex.use(0)
             
             program = self.programs[1]
@@ -67,6 +279,23 @@ class Shader:
             program['tex'].value = 0
             program['time'].value = t
             
-            self.render_objects[1].render(mode=moderngl.TRIANGLE_STRIP)
-            
-            ui_tex.release()
+            program.render()
+
+        if self.overlay:
+            fill, radius, flash = self.overlay
+            program = self.overlay_program
+            # radii are given in ui pixels
+            program['resolution'].value = frame_size(ui_surf or surf)
+            program['fill'].value = tuple(c / 255 for c in fill)
+            program['radius'].value = -1.0 if radius is None else radius
+            program['flash'].value = -1.0 if flash is None else flash / 255
+
+            program.render()
+            self.overlay = None
+
+        if self.render_scale < 1:
+            screen.use()
+            self.ctx.viewport = viewport
+            self.post.use(0)
+            self.present_program['tex'].value = 0
+            self.present_program.render()
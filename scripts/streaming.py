@@ -0,0 +1,296 @@
+import queue
+import threading
+from array import array
+
+from scripts.tilemap import Tilemap, LAYERS, EMPTY, CHUNK_SIZE
+
+def copy_tiles(src, dst, rect):
+    # src/dst are (origin, width, height, layers, rotations) grids, rect is (x, y, w, h) in tiles
+    left = max(rect[0], src[0][0], dst[0][0])
+    top = max(rect[1], src[0][1], dst[0][1])
+    right = min(rect[0] + rect[2], src[0][0] + src[1], dst[0][0] + dst[1])
+    bottom = min(rect[1] + rect[3], src[0][1] + src[2], dst[0][1] + dst[2])
+    if left >= right:
+        return
+
+    width = right - left
+    for y in range(top, bottom):
+        s = (y - src[0][1]) * src[1] + left - src[0][0]
+        d = (y - dst[0][1]) * dst[1] + left - dst[0][0]
+        for layer in LAYERS:
+            memoryview(dst[3][layer])[d:d + width] = memoryview(src[3][layer])[s:s + width]
+        memoryview(dst[4])[d:d + width] = memoryview(src[4])[s:s + width]
+
+def empty_grid(origin, width, height):
+    cells = width * height
+    return (origin, width, height, {layer: array('h', [EMPTY]) * cells for layer in LAYERS}, array('B', bytes(cells)))
+
+class StreamingTilemap(Tilemap):
+    # keeps only a window of regions around the camera resident; the rest of a binary level stays in the mmap.
+    # region_size has to be a multiple of CHUNK_SIZE so baked chunks never straddle the window edge
+    def __init__(self, tile_size=16, region_size=32, margin=1, max_regions=48):
+        self.source = None
+        self.edits = {}
+        super().__init__(tile_size)
+
+        self.region_size = region_size
+        self.margin = margin
+        self.max_regions = max_regions
+
+        self.window = None
+        self.last_offset = None
+
+        self.generation = 0
+        self.prefetched = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.worker = None
+
+    def grid(self):
+        return (self.origin, self.width, self.height, self.layers, self.rotations)
+
+    def load(self, path):
+        if path.endswith('.json'):
+            self.source = None
+            return super().load(path)
+
+        tile_size, origin, size, layers, rotations = self.read_binary(path)
+        self.tile_size = tile_size
+        self.source = (origin, size[0], size[1], layers, rotations)
+        self.build_tile_flags(layers['physics'])
+        self.edits = {}
+        self.window = None
+        self.reset()
+
+        with self.lock:
+            self.generation += 1
+            self.prefetched = {}
+            self.pending = set()
+
+        self.record(None)
+
+    def stop_streaming(self):
+        if self.source:
+            full = self.materialize()
+            self.source = None
+            self.window = None
+            self.reset(full.origin, (full.width, full.height), full.layers, full.rotations)
+            self.record(None)
+
+    def materialize(self):
+        full = Tilemap(self.tile_size)
+        full.reset(self.source[0], self.source[1:3])
+        copy_tiles(self.source, (full.origin, full.width, full.height, full.layers, full.rotations),
+                   (self.source[0][0], self.source[0][1], self.source[1], self.source[2]))
+        for (layer, x, y), (tile_id, rotation) in self.edits.items():
+            full.set_tile(layer, x, y, tile_id, rotation * 90)
+        return full
+
+    def region_rect(self, region):
+        return (region[0] * self.region_size, region[1] * self.region_size, self.region_size, self.region_size)
+
+    def read_region(self, region, source):
+        rect = self.region_rect(region)
+        grid = empty_grid(rect[:2], self.region_size, self.region_size)
+        copy_tiles(source, grid, rect)
+        return grid
+
+    def apply_edits(self, rect):
+        for (layer, x, y), (tile_id, rotation) in self.edits.items():
+            if rect[0] <= x < rect[0] + rect[2] and rect[1] <= y < rect[1] + rect[3]:
+                i = self.index(x, y)
+                self.layers[layer][i] = tile_id
+                if layer == 'background':
+                    self.rotations[i] = rotation
+
+    def move_window(self, window):
+        old, old_window, old_chunks, old_collision = self.grid(), self.window, self.chunks, self.collision
+        left, top, right, bottom = window
+        self.reset((left * self.region_size, top * self.region_size),
+                   ((right - left) * self.region_size, (bottom - top) * self.region_size))
+        self.window = window
+
+        for ry in range(top, bottom):
+            for rx in range(left, right):
+                rect = self.region_rect((rx, ry))
+                if old_window and old_window[0] <= rx < old_window[2] and old_window[1] <= ry < old_window[3]:
+                    copy_tiles(old, self.grid(), rect)
+                    continue
+
+                with self.lock:
+                    region = self.prefetched.pop((rx, ry), None)
+                copy_tiles(region or self.read_region((rx, ry), self.source), self.grid(), rect)
+                self.apply_edits(rect)
+
+        # baked chunks and merged collision stay valid as long as they are fully resident
+        for old_cache, cache in [(old_chunks['main'], self.chunks['main']), (old_chunks['decoration'], self.chunks['decoration']),
+                                 (old_collision, self.collision)]:
+            for cx, cy in old_cache:
+                if self.origin[0] <= cx * CHUNK_SIZE < self.origin[0] + self.width and self.origin[1] <= cy * CHUNK_SIZE < self.origin[1] + self.height:
+                    cache[(cx, cy)] = old_cache[(cx, cy)]
+
+        self.record(None)
+
+    def stream(self, offset, size):
+        if not self.source:
+            return
+
+        region_px = self.region_size * self.tile_size
+        window = (offset[0] // region_px - self.margin, offset[1] // region_px - self.margin,
+                  (offset[0] + size[0]) // region_px + self.margin + 1, (offset[1] + size[1]) // region_px + self.margin + 1)
+        if window != self.window and not self.covers(window):
+            self.move_window(window)
+
+        if self.last_offset:
+            self.prefetch(offset[0] - self.last_offset[0], offset[1] - self.last_offset[1])
+        self.last_offset = tuple(offset)
+
+    def covers(self, window):
+        # a window grown by require() is kept while it holds the camera's and stays within max_regions
+        if not self.window:
+            return False
+        left, top, right, bottom = self.window
+        return (left <= window[0] and top <= window[1] and right >= window[2] and bottom >= window[3]
+                and (right - left) * (bottom - top) <= self.max_regions)
+
+    def prefetch(self, dx, dy):
+        left, top, right, bottom = self.window
+        regions = []
+        if dx:
+            rx = right if dx > 0 else left - 1
+            regions += [(rx, ry) for ry in range(top, bottom)]
+        if dy:
+            ry = bottom if dy > 0 else top - 1
+            regions += [(rx, ry) for rx in range(left, right)]
+
+        with self.lock:
+            for region in regions:
+                if region not in self.prefetched and region not in self.pending:
+                    self.pending.add(region)
+                    self.requests.put((self.generation, self.source, region))
+
+        if regions and not self.worker:
+            self.worker = threading.Thread(target=self.prefetch_worker, daemon=True)
+            self.worker.start()
+
+    def prefetch_worker(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            generation, source, region = request
+            grid = self.read_region(region, source)
+
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                self.pending.discard(region)
+                self.prefetched[region] = grid
+                self.evict()
+
+    def close(self):
+        # stops the prefetch thread, regions that were still queued are dropped
+        with self.lock:
+            self.generation += 1
+            self.pending = set()
+        if self.worker:
+            self.requests.put(None)
+            self.worker.join()
+            self.worker = None
+
+    def evict(self):
+        # drop the prefetched regions farthest from the window once over budget
+        if not self.window:
+            return
+        left, top, right, bottom = self.window
+        budget = self.max_regions - (right - left) * (bottom - top)
+        center = ((left + right) / 2, (top + bottom) / 2)
+        while self.prefetched and len(self.prefetched) > max(0, budget):
+            far = max(self.prefetched, key=lambda r: abs(r[0] + 0.5 - center[0]) + abs(r[1] + 0.5 - center[1]))
+            del self.prefetched[far]
+
+    def require(self, pos):
+        # physics queries outside the window pull their region in synchronously
+        x, y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        if not self.source or self.index(x, y) >= 0:
+            return
+        if not (self.source[0][0] <= x < self.source[0][0] + self.source[1] and self.source[0][1] <= y < self.source[0][1] + self.source[2]):
+            return
+
+        rx, ry = x // self.region_size, y // self.region_size
+        half = max(1, self.margin)
+        window = (rx - half, ry - half, rx + half + 1, ry + half + 1)
+        # grown to hold the camera window as well, so the frame still draws and the next stream() keeps it
+        if self.window:
+            window = (min(window[0], self.window[0]), min(window[1], self.window[1]),
+                      max(window[2], self.window[2]), max(window[3], self.window[3]))
+        self.move_window(window)
+
+    def tiles_around(self, pos, layer):
+        self.require(pos)
+        return super().tiles_around(pos, layer)
+
+    def solid_check(self, pos):
+        self.require(pos)
+        return super().solid_check(pos)
+
+    def sweep(self, rect, movement):
+        self.require(rect[:2])
+        return super().sweep(rect, movement)
+
+    def triggers(self, pos, size, sides):
+        self.require(pos)
+        return super().triggers(pos, size, sides)
+
+    def set_tile(self, layer, x, y, tile_id, rotation=0):
+        if not self.source:
+            return super().set_tile(layer, x, y, tile_id, rotation)
+
+        # edits outlive eviction; tiles outside the window are written back when their region returns
+        key = (layer, x, y)
+        if self.index(x, y) >= 0:
+            self.edits[key] = (tile_id, rotation // 90 % 4)
+            return super().set_tile(layer, x, y, tile_id, rotation)
+
+        old_id = self.edits[key][0] if key in self.edits else self.source_tile(layer, x, y)
+        self.edits[key] = (tile_id, rotation // 90 % 4)
+        self.record((layer, x, y, old_id, tile_id, rotation // 90 % 4))
+
+    def source_tile(self, layer, x, y):
+        origin, width, height = self.source[:3]
+        if origin[0] <= x < origin[0] + width and origin[1] <= y < origin[1] + height:
+            return self.source[3][layer][(y - origin[1]) * width + x - origin[0]]
+        return EMPTY
+
+    def find_tiles(self, tile_id):
+        # only resident regions and edited tiles are searched while streaming
+        found = super().find_tiles(tile_id)
+        for (layer, x, y), (edit_id, rotation) in self.edits.items():
+            if edit_id == tile_id and self.index(x, y) < 0:
+                found.append((layer, x, y))
+        return found
+
+    @property
+    def tilemap(self):
+        if self.source:
+            return self.materialize().tilemap
+        return Tilemap.tilemap.fget(self)
+
+    @tilemap.setter
+    def tilemap(self, tilemap):
+        self.source = None
+        self.window = None
+        Tilemap.tilemap.fset(self, tilemap)
+
+    @property
+    def rotateset(self):
+        if self.source:
+            return self.materialize().rotateset
+        return Tilemap.rotateset.fget(self)
+
+    @rotateset.setter
+    def rotateset(self, rotateset):
+        if rotateset:
+            self.stop_streaming()
+            Tilemap.rotateset.fset(self, rotateset)
@@ -0,0 +1,83 @@
+import pygame
+
+# everything that draws text shares these: fonts by (path, size), rendered strings by (font, text, colour, alpha)
+# and glyph atlases by (font, colour)
+fonts = {}
+texts = {}
+atlases = {}
+# text that never repeats would grow the cache forever, it starts over past this many strings
+TEXT_LIMIT = 1024
+ATLAS_CHARS = ''.join(chr(code) for code in range(32, 127))
+
+def get_font(path, size):
+    key = (path, size)
+    if key not in fonts:
+        fonts[key] = pygame.font.Font(path, size)
+    return fonts[key]
+
+def render_text(font, text, color, alpha=255):
+    # the surface is shared: never draw on it or change its alpha, fading text asks for its alpha here
+    key = (font, text, tuple(color), alpha)
+    surf = texts.get(key)
+    if surf is None:
+        if alpha == 255:
+            surf = font.render(text, True, color)
+        else:
+            surf = render_text(font, text, color).copy()
+            surf.set_alpha(alpha)
+        if len(texts) >= TEXT_LIMIT:
+            texts.clear()
+        texts[key] = surf
+    return surf
+
+def glyph_atlas(font, color):
+    key = (font, tuple(color))
+    if key not in atlases:
+        atlases[key] = GlyphAtlas(font, color)
+    return atlases[key]
+
+class GlyphAtlas:
+    # printable ascii of one font and colour on one surface, for strings that change too often to cache whole
+    # (counters, typewriter lines); other characters fall back to render_text one by one
+    def __init__(self, font, color, chars=ATLAS_CHARS):
+        self.font = font
+        self.color = tuple(color)
+
+        images = [font.render(char, True, color) for char in chars]
+        self.height = max(image.get_height() for image in images)
+        self.surf = pygame.Surface((sum(image.get_width() for image in images), self.height), pygame.SRCALPHA)
+        self.glyphs = {}
+        x = 0
+        for char, image in zip(chars, images):
+            # max keeps the antialiased edges as rendered instead of blending them with the empty atlas
+            self.surf.blit(image, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.glyphs[char] = pygame.Rect(x, 0, image.get_width(), self.height)
+            x += image.get_width()
+        # (char, next char) -> distance between them, kerning included
+        self.advances = {}
+
+    def advance(self, char, next_char):
+        key = (char, next_char)
+        if key not in self.advances:
+            self.advances[key] = self.font.size(char + next_char)[0] - self.font.size(next_char)[0]
+        return self.advances[key]
+
+    def size(self, text):
+        if not text:
+            return 0, self.height
+        width = self.font.size(text[-1])[0] if text[-1] not in self.glyphs else self.glyphs[text[-1]].width
+        for i in range(len(text) - 1):
+            width += self.advance(text[i], text[i + 1])
+        return width, self.height
+
+    def draw(self, surf, text, pos):
+        x, y = pos
+        for i, char in enumerate(text):
+            glyph = self.glyphs.get(char)
+            if glyph:
+                surf.blit(self.surf, (x, y), glyph)
+            else:
+                surf.blit(render_text(self.font, char, self.color), (x, y))
+            if i + 1 < len(text):
+                x += self.advance(char, text[i + 1])
+        return pygame.Rect(pos, self.size(text))
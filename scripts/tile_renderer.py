@@ -0,0 +1,126 @@
+from array import array
+
+import moderngl
+import pygame
+
+from scripts.tilemap import LAYERS, EMPTY
+
+class TileRenderer:
+    # draws the tilemap on the gpu: the tileset is one atlas texture, every layer is an integer texture
+    # of tile ids kept in sync through tilemap subscribers and is one instanced draw into its own target.
+    # a target is only redrawn when the camera moved or one of its tiles changed
+    def __init__(self, shader, tileset, tilemap, size):
+        self.ctx = ctx = shader.ctx
+        self.tilemap = tilemap
+        self.size = size
+
+        self.quad = ctx.buffer(data=array('f', [0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 1.0, 1.0]))
+        self.manager = shader.manager
+        self.program = self.manager.load('tiles', 'tiles', [(self.quad, '2f', 'vert')])
+
+        image = tileset.tileset_image
+        self.atlas = ctx.texture(image.get_size(), 4, pygame.image.tobytes(image, 'RGBA'))
+        self.atlas.filter = (moderngl.NEAREST, moderngl.NEAREST)
+
+        self.targets = {}
+        for layer in LAYERS:
+            texture = ctx.texture(size, 4)
+            texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+            self.targets[layer] = (texture, ctx.framebuffer(color_attachments=[texture]))
+
+        self.dirty = set(LAYERS)
+        self.last_scroll = None
+        self.grid_size = None
+        self.origin = None
+        self.upload()
+        tilemap.subscribe(self.tile_changed)
+
+    def upload(self):
+        tilemap = self.tilemap
+        size = (max(1, tilemap.width), max(1, tilemap.height))
+        if size != self.grid_size:
+            if self.grid_size:
+                for texture in self.layers.values():
+                    texture.release()
+                self.rotations.release()
+            self.layers = {layer: self.ctx.texture(size, 1, dtype='i2') for layer in LAYERS}
+            self.rotations = self.ctx.texture(size, 1, dtype='u1')
+            for texture in [*self.layers.values(), self.rotations]:
+                texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+            self.grid_size = size
+
+        self.origin = tuple(tilemap.origin)
+        self.dirty = set(LAYERS)
+        if tilemap.width and tilemap.height:
+            for layer, tiles in tilemap.layers.items():
+                self.layers[layer].write(tiles)
+            self.rotations.write(tilemap.rotations)
+        else:
+            for texture in self.layers.values():
+                texture.write(array('h', [EMPTY]))
+
+    def release(self):
+        self.tilemap.unsubscribe(self.tile_changed)
+        self.manager.unload(self.program)
+        self.quad.release()
+        self.atlas.release()
+        for texture, fbo in self.targets.values():
+            fbo.release()
+            texture.release()
+        for texture in self.layers.values():
+            texture.release()
+        self.rotations.release()
+
+    def tile_changed(self, change):
+        tilemap = self.tilemap
+        if not change or tuple(tilemap.origin) != self.origin or (tilemap.width, tilemap.height) != self.grid_size:
+            return self.upload()
+
+        layer, x, y, old_id, tile_id, turns = change
+        gx, gy = x - self.origin[0], y - self.origin[1]
+        # edits outside a streaming window arrive with the region later
+        if 0 <= gx < self.grid_size[0] and 0 <= gy < self.grid_size[1]:
+            self.layers[layer].write(array('h', [tile_id]), viewport=(gx, gy, 1, 1))
+            self.dirty.add(layer)
+            if layer == 'background':
+                self.rotations.write(bytes([turns]), viewport=(gx, gy, 1, 1))
+
+    def render(self, scroll):
+        # returns the target of every layer and the layers redrawn this time
+        if tuple(scroll) != self.last_scroll:
+            self.last_scroll = tuple(scroll)
+            self.dirty = set(LAYERS)
+        changed, self.dirty = self.dirty, set()
+        if not changed:
+            return {layer: target[0] for layer, target in self.targets.items()}, changed
+
+        tile_size = self.tilemap.tile_size
+        columns = self.size[0] // tile_size + 2
+        rows = self.size[1] // tile_size + 2
+
+        program = self.program
+        program['origin'].value = self.origin
+        program['first_tile'].value = (scroll[0] // tile_size, scroll[1] // tile_size)
+        program['columns'].value = columns
+        program['scroll'].value = tuple(scroll)
+        program['resolution'].value = self.size
+        program['tile_size'].value = tile_size
+
+        self.atlas.use(0)
+        self.rotations.use(1)
+        program['atlas'].value = 0
+        program['rotations'].value = 1
+        program['tiles'].value = 2
+
+        previous = self.ctx.fbo
+        for layer in changed:
+            self.layers[layer].use(2)
+            program['rotate'].value = layer == 'background'
+
+            fbo = self.targets[layer][1]
+            fbo.use()
+            fbo.clear(0.0, 0.0, 0.0, 0.0)
+            program.render(moderngl.TRIANGLE_STRIP, instances=columns * rows)
+        previous.use()
+
+        return {layer: target[0] for layer, target in self.targets.items()}, changed
@@ -1,97 +1,466 @@
 import json
+import mmap
+import struct
+import sys
+from array import array
 
 import pygame
 
+from scripts.collision import merge_cells, sweep_aabb
+
 NEIGHBOR_OFFSETS = [(-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (0, 0), (-1, 1), (0, 1), (1, 1)]
-PHYSICS_TILES = []
+
+# tile flags, tested with tilemap.flags[tile_id] & FLAG
+SOLID = 1
+LETHAL = 2
+BOUNCE = 4
+END = 8
+CHECKPOINT = 16
+SPREADING = 32
+
+TILE_FLAGS = {
+    10: LETHAL, 22: LETHAL, 77: LETHAL, 78: LETHAL,
+    139: BOUNCE,
+    140: END,
+    110: CHECKPOINT, 111: CHECKPOINT,
+    44: SPREADING,
+}
+INACTIVE_CHECKPOINT = 110
+ACTIVE_CHECKPOINT = 111
+# one entry per possible int16 id; EMPTY (-1) reads the last entry, which is never flagged
+MAX_TILE_ID = 1 << 15
+
+# layer name -> separator used by the old "x;y" style keys
+LAYERS = {'background': '|', 'physics': ';', 'decoration': ':'}
+EMPTY = -1
+
+# chunk edge in tiles; 'main' chunks hold background + physics, 'decoration' the decor layer
+CHUNK_SIZE = 16
+CHUNK_GROUPS = {'background': 'main', 'physics': 'main', 'decoration': 'decoration'}
+
+# binary level: header, then one int16 grid per layer in LAYERS order, then the uint8 rotation grid
+LEVEL_MAGIC = b'WJBL'
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct('<4sHHiiII')
 
 class Tilemap:
     def __init__(self, tile_size=16):
         self.tile_size = tile_size
-        self.tilemap = {}
         self.decor_tiles = []
-        
+
         self.tiles = {}
-    
+        self.reset()
+        self.build_tile_flags()
+
+        # everything that wants to hear about tile changes
+        self.subscribers = [self.update_chunks, self.update_tile_index, self.update_collision]
+
+    def reset(self, origin=(0, 0), size=(0, 0), layers=None, rotations=None):
+        self.origin = list(origin)
+        self.width, self.height = size
+
+        cells = self.width * self.height
+        self.layers = layers or {layer: array('h', [EMPTY]) * cells for layer in LAYERS}
+        # quarter turns of background tiles
+        self.rotations = rotations if rotations is not None else array('B', bytes(cells))
+
+        self.chunks = {'main': {}, 'decoration': {}}
+        # tile id -> {(layer, x, y)}, built on the first find_tiles and kept current by set_tile
+        self.tile_index = None
+        # chunk -> merged solid rects in pixels, built on the first collision query in that chunk
+        self.collision = {}
+
+    def index(self, x, y):
+        x -= self.origin[0]
+        y -= self.origin[1]
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return -1
+
+    def grow(self, x, y):
+        left, top = min(self.origin[0], x), min(self.origin[1], y)
+        right = max(self.origin[0] + self.width, x + 1)
+        bottom = max(self.origin[1] + self.height, y + 1)
+
+        old_origin, old_width, old_height = self.origin, self.width, self.height
+        old_layers, old_rotations = self.layers, self.rotations
+        old_chunks, old_index, old_collision = self.chunks, self.tile_index, self.collision
+        self.reset((left, top), (right - left, bottom - top))
+        self.chunks, self.tile_index, self.collision = old_chunks, old_index, old_collision
+
+        for row in range(old_height):
+            src = row * old_width
+            dst = self.index(old_origin[0], old_origin[1] + row)
+            # through memoryviews so mmapped grids copy the same way as arrays
+            for layer, tiles in old_layers.items():
+                memoryview(self.layers[layer])[dst:dst + old_width] = memoryview(tiles)[src:src + old_width]
+            memoryview(self.rotations)[dst:dst + old_width] = memoryview(old_rotations)[src:src + old_width]
+
+    def build_tile_flags(self, physics=None):
+        self.flags = array('B', bytes(MAX_TILE_ID))
+        for tile_id, flags in TILE_FLAGS.items():
+            self.flags[tile_id] = flags
+
+        # everything placed on the physics layer collides
+        for tile_id in set(self.layers['physics'] if physics is None else physics):
+            if tile_id != EMPTY:
+                self.flags[tile_id] |= SOLID
+
+    def get_tile(self, layer, x, y):
+        i = self.index(x, y)
+        if i < 0:
+            return EMPTY
+        return self.layers[layer][i]
+
+    def set_tile(self, layer, x, y, tile_id, rotation=0):
+        i = self.index(x, y)
+        if i < 0:
+            self.grow(x, y)
+            i = self.index(x, y)
+
+        old_id = self.layers[layer][i]
+        self.layers[layer][i] = tile_id
+        if layer == 'background':
+            self.rotations[i] = rotation // 90 % 4
+        elif layer == 'physics' and tile_id != EMPTY:
+            self.flags[tile_id] |= SOLID
+
+        self.record((layer, x, y, old_id, tile_id, rotation // 90 % 4))
+
+    def clear_tile(self, layer, x, y):
+        if self.get_tile(layer, x, y) != EMPTY:
+            self.set_tile(layer, x, y, EMPTY)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def record(self, change):
+        # change is (layer, x, y, old_id, tile_id, quarter_turns), or None when every resident tile was replaced
+        for callback in self.subscribers:
+            callback(change)
+
+    # derived structures are reset along with the grid, so they only follow single tile changes
+    def update_chunks(self, change):
+        if change:
+            layer, x, y = change[:3]
+            self.chunks[CHUNK_GROUPS[layer]].pop((x // CHUNK_SIZE, y // CHUNK_SIZE), None)
+
+    def update_tile_index(self, change):
+        if not change or self.tile_index is None:
+            return
+
+        layer, x, y, old_id, tile_id = change[:5]
+        if old_id != tile_id and self.index(x, y) >= 0:
+            if old_id != EMPTY:
+                self.tile_index[old_id].discard((layer, x, y))
+            if tile_id != EMPTY:
+                self.tile_index.setdefault(tile_id, set()).add((layer, x, y))
+
+    def update_collision(self, change):
+        if change and change[0] == 'physics' and (self.flags[change[3]] ^ self.flags[change[4]]) & SOLID:
+            self.collision.pop((change[1] // CHUNK_SIZE, change[2] // CHUNK_SIZE), None)
+
+    def build_tile_index(self):
+        self.tile_index = {}
+        for layer, tiles in self.layers.items():
+            for i, tile_id in enumerate(tiles):
+                if tile_id != EMPTY:
+                    self.tile_index.setdefault(tile_id, set()).add((layer, i % self.width + self.origin[0], i // self.width + self.origin[1]))
+
+    def find_tiles(self, tile_id):
+        if self.tile_index is None:
+            self.build_tile_index()
+        return list(self.tile_index.get(tile_id, ()))
+
     def tile_exists(self, x, y):
-        
-        if f"{x}|{y}" in self.tilemap or f"{x};{y}" in self.tilemap:
+        i = self.index(x, y)
+
+        if i >= 0 and (self.layers['background'][i] != EMPTY or self.layers['physics'][i] != EMPTY):
             return True
-        
+
         return False
-    
-    def tiles_around(self, pos, dot):
+
+    def color_at(self, tileset, pos):
+        # colour of the topmost tile pixel at a world position, black where there is no tile
+        x, y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        i = self.index(x, y)
+        local = (int(pos[0]) - x * self.tile_size, int(pos[1]) - y * self.tile_size)
+        for layer in ['physics', 'background']:
+            if i >= 0 and self.layers[layer][i] != EMPTY:
+                tile = tileset.rotated(self.layers[layer][i], self.rotations[i]) if layer == 'background' else tileset[self.layers[layer][i]]
+                color = tile.get_at(local)
+                if color[:3] != (0, 0, 0):
+                    return color
+        return pygame.Color(0, 0, 0, 0)
+
+    def tiles_around(self, pos, layer):
         tiles = []
         tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        layer_tiles = self.layers[layer]
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + dot + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            check_loc = (tile_loc[0] + offset[0], tile_loc[1] + offset[1])
+            i = self.index(*check_loc)
+            if i >= 0 and layer_tiles[i] != EMPTY:
+                tiles.append((layer_tiles[i], check_loc))
         return tiles
-    
+
+    # json compatibility view: {"x;y": {"tile_id": "0", "pos": [x, y]}}
+    @property
+    def tilemap(self):
+        tilemap = {}
+        for layer, separator in LAYERS.items():
+            for i, tile_id in enumerate(self.layers[layer]):
+                if tile_id != EMPTY:
+                    x, y = i % self.width + self.origin[0], i // self.width + self.origin[1]
+                    tilemap[f'{x}{separator}{y}'] = {'tile_id': str(tile_id), 'pos': [x, y]}
+        return tilemap
+
+    @tilemap.setter
+    def tilemap(self, tilemap):
+        xs = [tile['pos'][0] for tile in tilemap.values()]
+        ys = [tile['pos'][1] for tile in tilemap.values()]
+        if xs:
+            self.reset((min(xs), min(ys)), (max(xs) - min(xs) + 1, max(ys) - min(ys) + 1))
+        else:
+            self.reset()
+
+        for key, tile in tilemap.items():
+            for layer, separator in LAYERS.items():
+                if separator in key:
+                    self.layers[layer][self.index(*tile['pos'])] = int(tile['tile_id'])
+                    break
+
+        self.build_tile_flags()
+        self.record(None)
+
+    # {"x|y": angle} for rotated background tiles
+    @property
+    def rotateset(self):
+        rotateset = {}
+        for i, rotation in enumerate(self.rotations):
+            if rotation:
+                rotateset[f'{i % self.width + self.origin[0]}|{i // self.width + self.origin[1]}'] = rotation * 90
+        return rotateset
+
+    @rotateset.setter
+    def rotateset(self, rotateset):
+        for key, angle in rotateset.items():
+            x, y = (int(n) for n in key.split('|'))
+            if self.index(x, y) >= 0:
+                self.set_tile('background', x, y, self.get_tile('background', x, y), int(angle))
+
     def save(self, path):
+        if not path.endswith('.json'):
+            return self.save_binary(path)
+
+        map_data = {'tilemap': self.tilemap, 'tile_size': self.tile_size}
+        if self.rotateset:
+            map_data['rotateset'] = self.rotateset
+
         f = open(path, 'w')
-        json.dump({'tilemap': self.tilemap, 'tile_size': self.tile_size}, f)
+        json.dump(map_data, f)
         f.close()
-        
+
     def load(self, path):
+        if not path.endswith('.json'):
+            return self.load_binary(path)
+
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
-        
-        self.tilemap = map_data['tilemap']
+
         self.tile_size = map_data['tile_size']
-        
+        self.tilemap = map_data['tilemap']
+        self.rotateset = map_data.get('rotateset', {})
+
+    def save_binary(self, path):
+        f = open(path, 'wb')
+        f.write(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, self.tile_size, self.origin[0], self.origin[1], self.width, self.height))
+        for layer in LAYERS:
+            tiles = array('h', self.layers[layer])
+            if sys.byteorder == 'big':
+                tiles.byteswap()
+            f.write(tiles.tobytes())
+        f.write(bytes(self.rotations))
+        f.close()
+
+    def load_binary(self, path):
+        tile_size, origin, size, layers, rotations = self.read_binary(path)
+
+        self.tile_size = tile_size
+        self.reset(origin, size, layers, rotations)
+        self.build_tile_flags()
+        self.record(None)
+
+    def read_binary(self, path):
+        f = open(path, 'rb')
+        # copy-on-write: set_tile edits stay in memory and never reach the file
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        f.close()
+
+        magic, version, tile_size, x, y, width, height = LEVEL_HEADER.unpack_from(data)
+        if magic != LEVEL_MAGIC or version != LEVEL_VERSION:
+            raise ValueError(f'{path} is not a version {LEVEL_VERSION} level file')
+
+        cells = width * height
+        view = memoryview(data)
+        offset = LEVEL_HEADER.size
+
+        layers = {}
+        for layer in LAYERS:
+            layers[layer] = view[offset:offset + cells * 2].cast('h')
+            if sys.byteorder == 'big':
+                layers[layer] = array('h', layers[layer])
+                layers[layer].byteswap()
+            offset += cells * 2
+
+        return tile_size, (x, y), (width, height), layers, view[offset:offset + cells]
+
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ';' + str(int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap:
-            if self.tilemap[tile_loc]['tile_id'] in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
-    
-    def physics_rects_around(self, pos):
+        tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        tile_id = self.get_tile('physics', *tile_loc)
+        if self.flags[tile_id] & SOLID:
+            return tile_id, tile_loc
+
+    def triggers(self, pos, size, sides):
+        # one pass over the entity's neighbourhood. returns (flags, checkpoint, contact):
+        # BOUNCE/END from background tiles around pos, LETHAL when a touching side rests on two solids
+        # of which one is lethal, the position of an inactive checkpoint in reach, and the solid tile
+        # under the first corner of the last touching side
+        flags, checkpoint, contact = 0, None, None
+        tile_flags, background, decoration = self.flags, self.layers['background'], self.layers['decoration']
+
+        tx, ty = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        for y in range(max(ty - 1, self.origin[1]), min(ty + 2, self.origin[1] + self.height)):
+            row = (y - self.origin[1]) * self.width - self.origin[0]
+            for x in range(max(tx - 1, self.origin[0]), min(tx + 2, self.origin[0] + self.width)):
+                flags |= tile_flags[background[row + x]] & (BOUNCE | END)
+                if decoration[row + x] == INACTIVE_CHECKPOINT:
+                    checkpoint = (x, y)
+
+        x, y, w, h = pos[0], pos[1], size[0], size[1]
+        for side, ax, ay, bx, by in (('down', x, y + h, x + w, y + h), ('up', x, y - 1, x + w, y - 1),
+                                     ('left', x - 1, y, x - 1, y + h), ('right', x + w + 1, y, x + w + 1, y + h)):
+            if not sides[side]:
+                continue
+
+            a_loc = (int(ax // self.tile_size), int(ay // self.tile_size))
+            a_id = self.get_tile('physics', *a_loc)
+            a = tile_flags[a_id]
+            b = tile_flags[self.get_tile('physics', int(bx // self.tile_size), int(by // self.tile_size))]
+            contact = (a_id, a_loc) if a & SOLID else None
+            if a & b & SOLID and (a | b) & LETHAL:
+                flags |= LETHAL
+                break
+
+        return flags, checkpoint, contact
+
+    def collision_rects(self, chunk_loc):
+        if chunk_loc not in self.collision:
+            physics, flags = self.layers['physics'], self.flags
+
+            def is_solid(x, y):
+                i = self.index(x, y)
+                return i >= 0 and flags[physics[i]] & SOLID
+
+            self.collision[chunk_loc] = merge_cells(is_solid, chunk_loc[0] * CHUNK_SIZE, chunk_loc[1] * CHUNK_SIZE,
+                                                    CHUNK_SIZE, CHUNK_SIZE, self.tile_size)
+        return self.collision[chunk_loc]
+
+    def rects_in(self, area):
+        chunk_px = CHUNK_SIZE * self.tile_size
         rects = []
-        for tile in self.tiles_around(pos, ';'):
-            if tile['tile_id'] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
+        for cy in range(int(area[1] // chunk_px), int((area[1] + area[3]) // chunk_px) + 1):
+            for cx in range(int(area[0] // chunk_px), int((area[0] + area[2]) // chunk_px) + 1):
+                rects += self.collision_rects((cx, cy))
         return rects
 
-    def render(self, surf, decorations_surf, tileset, rotateset, offset=(0, 0)):
-            
-        for x in range(offset[0] // self.tile_size, (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size, (offset[1] + surf.get_height()) // self.tile_size + 1):
-                physics_loc = str(x) + ';' + str(y)
-                decor_loc = str(x) + ':' + str(y)
-                background_loc = str(x) + '|' + str(y)
-                
-                   
-                if background_loc in self.tilemap:
-                    tile = self.tilemap[background_loc]
-                    
-                    if background_loc in rotateset:
-                        print('')
-                        surf.blit((pygame.transform.rotate(tileset[tile['tile_id']], rotateset[f'{tile['pos'][0]}|{tile['pos'][1]}'])), (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))     
+    def sweep(self, rect, movement):
+        # moves rect by movement against the merged solids, sliding along whatever it hits.
+        # returns the new position and the normals of every contact
+        x, y, w, h = rect
+        dx, dy = movement
+        normals = []
+
+        candidates = self.rects_in((min(x, x + dx), min(y, y + dy), w + abs(dx), h + abs(dy)))
+        for _ in range(3):
+            if not dx and not dy:
+                break
+
+            hit = None
+            for other in candidates:
+                contact = sweep_aabb((x, y, w, h), dx, dy, other)
+                if contact and (not hit or contact[0] < hit[0]):
+                    hit = contact + (other,)
+
+            if not hit:
+                x += dx
+                y += dy
+                break
+
+            t, nx, ny, other = hit
+            # snap onto the touched edge so the next frame starts exactly in contact
+            if nx:
+                x = other[0] - w if nx < 0 else other[0] + other[2]
+                y += dy * t
+                dx, dy = 0, dy * (1 - t)
+            else:
+                x += dx * t
+                y = other[1] - h if ny < 0 else other[1] + other[3]
+                dx, dy = dx * (1 - t), 0
+            normals.append((nx, ny))
+
+        return x, y, normals
+
+    def bake_chunk(self, group, chunk_loc, tileset):
+        layers = ['background', 'physics'] if group == 'main' else ['decoration']
+        left, top = chunk_loc[0] * CHUNK_SIZE, chunk_loc[1] * CHUNK_SIZE
+
+        surf = None
+        for y in range(max(top, self.origin[1]), min(top + CHUNK_SIZE, self.origin[1] + self.height)):
+            row = (y - self.origin[1]) * self.width - self.origin[0]
+            for x in range(max(left, self.origin[0]), min(left + CHUNK_SIZE, self.origin[0] + self.width)):
+                i = row + x
+                for layer in layers:
+                    tile_id = self.layers[layer][i]
+                    if tile_id == EMPTY:
+                        continue
+
+                    if not surf:
+                        surf = pygame.Surface((CHUNK_SIZE * self.tile_size, CHUNK_SIZE * self.tile_size))
+                        surf.set_colorkey((0, 0, 0))
+
+                    pos = ((x - left) * self.tile_size, (y - top) * self.tile_size)
+                    if layer == 'background':
+                        surf.blit(tileset.rotated(tile_id, self.rotations[i]), pos)
                     else:
-                        surf.blit(tileset[tile['tile_id']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))     
-                    
-                
-                if physics_loc in self.tilemap:
-                    tile = self.tilemap[physics_loc]
-                    if not tile['tile_id'] in PHYSICS_TILES:
-                        PHYSICS_TILES.append(tile['tile_id'])
-                        
-                    surf.blit(tileset[tile['tile_id']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
-                    
-                if decor_loc in self.tilemap:
-                    tile = self.tilemap[decor_loc]
-            
-                    decorations_surf.blit(tileset[tile['tile_id']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
+                        surf.blit(tileset[tile_id], pos)
+
+        # empty chunks are cached as None so they are never rescanned
+        return surf
+
+    def render(self, surf, decorations_surf, tileset, offset=(0, 0)):
+        chunk_px = CHUNK_SIZE * self.tile_size
+
+        for cy in range(offset[1] // chunk_px, (offset[1] + surf.get_height()) // chunk_px + 1):
+            for cx in range(offset[0] // chunk_px, (offset[0] + surf.get_width()) // chunk_px + 1):
+                for group, target in (('main', surf), ('decoration', decorations_surf)):
+                    chunks = self.chunks[group]
+                    if (cx, cy) not in chunks:
+                        chunks[(cx, cy)] = self.bake_chunk(group, (cx, cy), tileset)
+
+                    if chunks[(cx, cy)]:
+                        target.blit(chunks[(cx, cy)], (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))
 
 class AnimBlock:
     def __init__(self, game, pos, angle, anim):
         self.angle = angle
         self.pos = list(pos)
         self.animation = anim
-        self.duration = self.animation.img_duration
+        self.duration = self.animation.animation.img_duration
         self.timer = 0
 
     def update(self):
@@ -100,6 +469,7 @@ class AnimBlock:
 
     def render(self, surf, offset=(0, 0)):
         if self.timer < self.duration:
-            pygame.draw.rect(surf, (0, 0, 0), (self.pos[0] * 16 - offset[0], self.pos[1] * 16 - offset[1], 16, 16))
-            surf.blit(pygame.transform.rotate(self.animation.img(), self.angle), 
-                      (self.pos[0] * 16 - offset[0], self.pos[1] * 16 - offset[1]))
\ No newline at end of file
+            # near black still hides the tile below in the compositor, pure black would be transparent
+            pygame.draw.rect(surf, (1, 0, 0), (self.pos[0] * 16 - offset[0], self.pos[1] * 16 - offset[1], 16, 16))
+            surf.blit(self.animation.img(turns=self.angle // 90),
+                      (self.pos[0] * 16 - offset[0], self.pos[1] * 16 - offset[1]))
@@ -1,5 +1,8 @@
 import pygame
 
+from scripts.utils import get_ticks
+from scripts.text import get_font, render_text, glyph_atlas
+
 class UI():
     def __init__(self, width, height, x, y):
         self.width = width
@@ -16,7 +19,7 @@ class UI():
         
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
         
-        self.font = pygame.font.Font("data/texts/LuckiestGuy-Regular.ttf", 12)
+        self.font = get_font("data/texts/LuckiestGuy-Regular.ttf", 12)
 
 class SkillsUI(UI):
     def __init__(self, width, height, img, x, y, kd, key):
@@ -32,8 +35,9 @@ class SkillsUI(UI):
         self.hover_end_time = 0 
         self.active = True
 
-    def render(self, surf, pressed):
-        current_time = pygame.time.get_ticks()
+    def update(self, pressed):
+        # returns everything the widget looks like, so an unchanged state means an unchanged image
+        current_time = get_ticks()
         
         if pressed == 'pressed':
             self.hover = True
@@ -56,11 +60,32 @@ class SkillsUI(UI):
 
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
 
+        self.overlay_height = 0
+        if not self.active:
+            if self.kd_time == 0:
+                self.kd_time = current_time
+
+            elapsed_time = current_time - self.kd_time
+            cooldown_progress = elapsed_time / (self.kd * 1000)
+
+            if cooldown_progress >= 1:
+                self.active = True
+                self.kd_time = 0
+            else:
+                self.overlay_height = int((self.height - 10) * (1 - cooldown_progress))
+
+        return (self.hover, self.active, self.overlay_height)
+
+    def bounds(self):
+        # the key square sticks out past the top left corner
+        return self.rect.inflate(4, 4)
+
+    def draw(self, surf):
         scaled_img = pygame.transform.scale(self.img, (self.width, self.height))
             
         surf.blit(scaled_img, (self.x, self.y))
 
-        key_text = self.font.render(self.key, True, (0, 0, 1))
+        key_text = render_text(self.font, self.key, (0, 0, 1))
         key_width, key_height = key_text.get_size()
         square_size = max(key_width, key_height) + 4
 
@@ -70,37 +95,28 @@ class SkillsUI(UI):
         text_x = square_x + (square_size - key_width) // 2
         text_y = square_y + (square_size - key_height) // 2
         
-        if not self.active:
-            current_time = pygame.time.get_ticks()
-
-            if self.kd_time == 0:
-                self.kd_time = current_time
-
-            elapsed_time = current_time - self.kd_time
-            cooldown_progress = elapsed_time / (self.kd * 1000)
+        if self.overlay_height:
+            overlay_surface = pygame.Surface((scaled_img.get_width() - 7, self.overlay_height), pygame.SRCALPHA)
+            overlay_surface.fill((0, 0, 0, 128))
 
-            if cooldown_progress >= 1:
-                self.active = True
-                self.kd_time = 0
-            else:
-                overlay_height = int((self.height - 10) * (1 - cooldown_progress))
-                overlay_surface = pygame.Surface((scaled_img.get_width() - 7, overlay_height), pygame.SRCALPHA)
-                overlay_surface.fill((0, 0, 0, 128))
-
-                surf.blit(overlay_surface, (self.x + 4, self.y + self.height - overlay_height - 5))
+            surf.blit(overlay_surface, (self.x + 4, self.y + self.height - self.overlay_height - 5))
         
         pygame.draw.rect(surf, (255, 255, 255), (square_x - 1, square_y - 1, square_size, square_size))
         pygame.draw.rect(surf, (0, 0, 1), (square_x - 1, square_y - 1, square_size, square_size), 2)
 
         surf.blit(key_text, (text_x, text_y))
 
+    def render(self, surf, pressed):
+        self.update(pressed)
+        self.draw(surf)
+
 class BuffUI(UI):
     def __init__(self, name, img, duration, width, height):
         super().__init__(width, height, 0, 0)
         
         self.img = img
         self.duration = duration
-        self.add_time = pygame.time.get_ticks()
+        self.add_time = get_ticks()
         
         self.active = True
         self.kd_time = 0
@@ -117,7 +133,7 @@ class BuffUI(UI):
         self.end = False
         self.clearing = False  
 
-    def render(self, surf, index):
+    def update(self, index):
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
 
         if index > 0:
@@ -127,8 +143,10 @@ class BuffUI(UI):
             self.target_x = index * self.width
             self.x += (self.target_x - self.x) * self.move_speed
 
+        # phase is None once the buff is gone, otherwise 'create', 'clear' or 'idle' scaled by progress
+        self.phase = None
         if self.active or self.clearing:
-            current_time = pygame.time.get_ticks()
+            current_time = get_ticks()
 
             if self.kd_time == 0:
                 self.kd_time = current_time
@@ -136,37 +154,15 @@ class BuffUI(UI):
             elapsed_time = current_time - self.kd_time
             cooldown_progress = elapsed_time / (self.duration * 1000)
             
-            remaining_time = max(0, (self.kd_time + self.duration * 1000 - current_time) / 1000)
-            key_text = self.font.render(str(int(remaining_time)), True, (0, 0, 1))
-            key_width, key_height = key_text.get_size()
-            square_size = max(key_width, key_height) + 4
-
-            kd_counter_surf = pygame.Surface((square_size, square_size), pygame.SRCALPHA)
-            pygame.draw.rect(kd_counter_surf, (255, 255, 255), (0, 0, square_size, square_size))
-            pygame.draw.rect(kd_counter_surf, (0, 0, 1), (0, 0, square_size, square_size), 2)
-            kd_counter_surf.blit(key_text, ((square_size - key_width) // 2, ((square_size - key_height) // 2)+1))
+            self.remaining_time = int(max(0, (self.kd_time + self.duration * 1000 - current_time) / 1000))
 
             if cooldown_progress >= 1 and not self.clearing:
                 self.active = False
                 self.kd_time = 0
 
             if current_time <= (self.add_time + self.create_duration * 1000):
-
-                elapsed_time = current_time - self.add_time
-                cooldown_progress = elapsed_time / (self.create_duration * 1000)
-
-                scaled_img = pygame.transform.scale(
-                    self.img, 
-                    (int(self.width * cooldown_progress), int(self.height * cooldown_progress))
-                )
-                
-                kd_counter_surf = pygame.transform.scale(
-                    kd_counter_surf, 
-                    (int(kd_counter_surf.get_width() * cooldown_progress), int(kd_counter_surf.get_height() * cooldown_progress))
-                )
-
-                surf.blit(scaled_img, (self.x + (25 - 25 * cooldown_progress), self.y + (25 - 25 * cooldown_progress)))
-                surf.blit(kd_counter_surf, ((self.x - square_size + 15), (self.y - square_size + 15)))
+                self.phase = 'create'
+                self.progress = (current_time - self.add_time) / (self.create_duration * 1000)
 
             elif self.clearing or current_time >= (self.add_time + (self.duration * 1000 - self.dissapear_duration * 1000)):
 
@@ -174,31 +170,113 @@ class BuffUI(UI):
                     self.clearing = True
                     self.clear_start_time = current_time 
 
-                elapsed_time = current_time - self.clear_start_time
-                cooldown_progress = 1 - (elapsed_time / (self.dissapear_duration * 1000))
-
-                if cooldown_progress > 0:
-                    scaled_img = pygame.transform.scale(
-                        self.img, 
-                        (int(self.width * cooldown_progress), int(self.height * cooldown_progress))
-                    )
-                    
-                    surf.blit(scaled_img, (self.x + (25 - 25 * cooldown_progress), self.y + (25 - 25 * cooldown_progress)))
-                
-                else:
+                self.phase = 'clear'
+                self.progress = 1 - ((current_time - self.clear_start_time) / (self.dissapear_duration * 1000))
+                if self.progress <= 0:
                     self.end = True  
-                
+
             else:
-                scaled_img = pygame.transform.scale(self.img, (self.width, self.height))
-                surf.blit(scaled_img, (self.x, self.y))
+                self.phase = 'idle'
+                self.progress = 1
+
+        if not self.phase:
+            return None
+        return (int(self.x), int(self.y), self.phase, self.progress, self.remaining_time)
+
+    def bounds(self):
+        # the countdown square hangs a few pixels off the top left corner
+        return pygame.Rect(int(self.x) - 5, int(self.y) - 5, self.width + 10, self.height + 10)
+
+    def draw(self, surf):
+        if not self.phase:
+            return
+
+        digits = glyph_atlas(self.font, (0, 0, 1))
+        key_width, key_height = digits.size(str(self.remaining_time))
+        square_size = max(key_width, key_height) + 4
+
+        kd_counter_surf = pygame.Surface((square_size, square_size), pygame.SRCALPHA)
+        pygame.draw.rect(kd_counter_surf, (255, 255, 255), (0, 0, square_size, square_size))
+        pygame.draw.rect(kd_counter_surf, (0, 0, 1), (0, 0, square_size, square_size), 2)
+        digits.draw(kd_counter_surf, str(self.remaining_time), ((square_size - key_width) // 2, ((square_size - key_height) // 2)+1))
+
+        if self.phase == 'create':
+            scaled_img = pygame.transform.scale(
+                self.img, 
+                (int(self.width * self.progress), int(self.height * self.progress))
+            )
+            
+            kd_counter_surf = pygame.transform.scale(
+                kd_counter_surf, 
+                (int(kd_counter_surf.get_width() * self.progress), int(kd_counter_surf.get_height() * self.progress))
+            )
+
+            surf.blit(scaled_img, (self.x + (25 - 25 * self.progress), self.y + (25 - 25 * self.progress)))
+            surf.blit(kd_counter_surf, ((self.x - square_size + 15), (self.y - square_size + 15)))
+
+        elif self.phase == 'clear':
+            if self.progress > 0:
+                scaled_img = pygame.transform.scale(
+                    self.img, 
+                    (int(self.width * self.progress), int(self.height * self.progress))
+                )
                 
-                surf.blit(kd_counter_surf, (self.x - square_size + 15, self.y - square_size + 15))
+                surf.blit(scaled_img, (self.x + (25 - 25 * self.progress), self.y + (25 - 25 * self.progress)))
             
         else:
+            scaled_img = pygame.transform.scale(self.img, (self.width, self.height))
+            surf.blit(scaled_img, (self.x, self.y))
+            
+            surf.blit(kd_counter_surf, (self.x - square_size + 15, self.y - square_size + 15))
+
+    def render(self, surf, index):
+        if not self.update(index):
             return self.name
+        self.draw(surf)
 
     def clear_buff(self):
 
         if not self.clearing:
             self.clearing = True
-            self.clear_start_time = pygame.time.get_ticks()
\ No newline at end of file
+            self.clear_start_time = get_ticks()
+class UILayer():
+    # retained ui surface: widgets are redrawn, and their area re-uploaded, only when their state changes
+    def __init__(self, size):
+        self.surf = pygame.Surface(size)
+        self.widgets = {}
+        self.submitted = []
+        self.dirty = [self.surf.get_rect()]
+
+    def widget(self, key, state, rect, draw):
+        # draw(surf) has to paint the same pixels for the same state, inside rect
+        old = self.widgets.get(key)
+        if not old:
+            self.dirty.append(rect)
+        elif old[0] != state or old[1] != rect:
+            self.dirty.append(rect.union(old[1]))
+        self.widgets[key] = (state, rect, draw)
+        self.submitted.append(key)
+
+    def invalidate(self, rect=None):
+        self.dirty.append(rect or self.surf.get_rect())
+
+    def flush(self):
+        # widgets that were not submitted this frame are gone, the rest stack in submission order;
+        # returns the rects that need uploading
+        for key in set(self.widgets) - set(self.submitted):
+            self.dirty.append(self.widgets.pop(key)[1])
+        self.widgets = {key: self.widgets[key] for key in self.submitted}
+        self.submitted = []
+
+        dirty = [rect.clip(self.surf.get_rect()) for rect in self.dirty]
+        self.dirty = []
+        dirty = [rect for rect in dirty if rect.width and rect.height]
+
+        for rect in dirty:
+            self.surf.set_clip(rect)
+            self.surf.fill((0, 0, 0))
+            for state, widget_rect, draw in self.widgets.values():
+                if widget_rect.colliderect(rect):
+                    draw(self.surf)
+        self.surf.set_clip(None)
+        return dirty
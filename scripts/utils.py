@@ -1,47 +1,73 @@
 import pygame
 
+from scripts.assets import assets
+
+# gameplay timers (cooldowns, buffs, vfx) run on the game clock, which only moves with game frames,
+# so a replay fed the recorded frame times expires them on the same frames as the session it came from
+game_ticks = 0.0
+
+def get_ticks():
+    return int(game_ticks)
+
+def advance_ticks(ms):
+    global game_ticks
+    game_ticks += ms
+
+def set_ticks(ms):
+    global game_ticks
+    game_ticks = ms
 
 def load_image(path):
-    img = pygame.image.load(path).convert()
-    img.set_colorkey((0, 0, 0))
-    return img
+    # shared with every other caller of the same path, see Assets
+    return assets.image(path)
+
 class Tileset():
     def __init__(self, tileset, tile_size):
         self.tileset = tileset
         self.tile_size = tile_size
-        self.tileset_image = pygame.image.load(self.tileset).convert()
-        self.tileset_image.set_colorkey((0, 0, 0))
+        self.tileset_image = load_image(self.tileset)
+
+        self.tiles = self.load_tileset()
+        # quarter turns -> every tile rotated that far, so rotated tiles blit like plain ones
+        self.rotations = [self.tiles] + [[pygame.transform.rotate(tile, turns * 90) for tile in self.tiles] for turns in (1, 2, 3)]
+
+    def __getitem__(self, tile_id):
+        return self.tiles[tile_id]
+
+    def rotated(self, tile_id, turns):
+        return self.rotations[turns % 4][tile_id]
         
     def load_tileset(self):
 
         tileset_width, tileset_height = self.tileset_image.get_size()
     
-        tiles = {}
-        tile_count = '-1'
+        tiles = []
         for y in range(0, tileset_height, self.tile_size):
             for x in range(0, tileset_width, self.tile_size):
-                tile_count = f'{int(tile_count)+1}'
-                
                 tile = self.tileset_image.subsurface(pygame.Rect(x, y, self.tile_size, self.tile_size))
-                tiles[tile_count] = tile
+                tiles.append(tile)
 
         return tiles
 class Animation:
-    def __init__(self, path, img_dur=5, loop=True, img_size=16):
+    # the frames of one animation, sliced once and shared; entities play it through their own AnimationCursor
+    def __init__(self, path, img_dur=5, loop=True, img_size=16, rotate=False):
         self.loop = loop
         self.img_duration = img_dur
-        self.done = False
-        self.frame = 0
         self.img_size = img_size
         self.path = path
         self.images = self.load_frames()
+        # mirrored once here instead of on every render of an entity facing left
+        self.flipped = [pygame.transform.flip(img, True, False) for img in self.images]
+        # quarter turns -> every frame rotated that far, like Tileset.rotations, for animations drawn turned
+        self.rotations = [self.images] + [[pygame.transform.rotate(img, turns * 90) for img in self.images] for turns in (1, 2, 3)] if rotate else None
+        self.length = self.img_duration * len(self.images)
     
-    def copy(self):
-        return Animation(self.path, self.img_duration, self.loop)
+    def play(self):
+        return AnimationCursor(self)
     
     def load_frames(self):
         image = load_image(self.path)
-        image_width, image_height = pygame.image.load(self.path).convert().get_size()
+        image_width, image_height = image.get_size()
     
         images = []
         for y in range(0, image_height, self.img_size):
@@ -50,13 +76,25 @@ class Animation:
                 images.append(img)
         return images
 
+class AnimationCursor:
+    # where one entity is in an Animation; starting an animation only makes one of these
+    def __init__(self, animation):
+        self.animation = animation
+        self.frame = 0
+        self.done = False
+
     def update(self):
-        if self.loop:
-            self.frame = (self.frame + 1) % (self.img_duration * len(self.images))
+        animation = self.animation
+        if animation.loop:
+            self.frame = (self.frame + 1) % animation.length
         else:
-            self.frame = min(self.frame + 1, self.img_duration * len(self.images) - 1)
-            if self.frame >= self.img_duration * len(self.images) - 1:
+            self.frame = min(self.frame + 1, animation.length - 1)
+            if self.frame >= animation.length - 1:
                 self.done = True
     
-    def img(self):
-        return self.images[int(self.frame / self.img_duration)]
\ No newline at end of file
+    def img(self, flip=False, turns=0):
+        if turns % 4:
+            images = self.animation.rotations[turns % 4]
+        else:
+            images = self.animation.flipped if flip else self.animation.images
+        return images[int(self.frame / self.animation.img_duration)]
\ No newline at end of file
@@ -0,0 +1,30 @@
+#version 330 core
+
+uniform sampler2D particles;
+uniform sampler2D background;
+uniform sampler2D physics;
+uniform sampler2D entities;
+uniform sampler2D decoration;
+
+in vec2 uvs;
+out vec4 f_color;
+
+vec4 over(vec4 color, sampler2D layer, vec2 uv) {
+    vec4 top = texture(layer, uv);
+    return top.rgb != vec3(0.0) ? top : color;
+}
+
+void main() {
+    // the scene framebuffer fills bottom-up; flip so its first row is the top of the frame like the layers
+    vec2 uv = vec2(uvs.x, 1.0 - uvs.y);
+
+    // later layers win wherever they are not black
+    vec4 color = vec4(0.0);
+    color = over(color, particles, uv);
+    color = over(color, background, uv);
+    color = over(color, physics, uv);
+    color = over(color, entities, uv);
+    color = over(color, decoration, uv);
+
+    f_color = color;
+}
@@ -4,6 +4,8 @@ uniform sampler2D tex;
 uniform float time;
 uniform vec2 resolution;
 uniform float noise_cof;
+// 2 everything, 1 without the per-pixel noise, 0 without scanlines and vignette either
+uniform int quality = 2;
 
 uniform float timeScale = 0.25;
 uniform float treshold = 0.3;
@@ -41,8 +43,10 @@ void main() {
 
     bgColor += radialGlow(uv);
 
-    float noiseValue = noise(uv * 10.0 + time * 0.1);
-    bgColor += noiseValue * 0.05;
+    if (quality > 1) {
+        float noiseValue = noise(uv * 10.0 + time * 0.1);
+        bgColor += noiseValue * 0.05;
+    }
 
     bgColor += vec4(sin(time * 0.15) * 0.05, cos(time * 0.013) * 0.05, sin(time * 0.07) * 0.05, 1.0);
 
@@ -53,15 +57,23 @@ void main() {
         color = texture(tex, uv);
     }
 
-    float scanline = sin(uv.y * 1000.0 + time * 10.0) * 0.05;
-    color.rgb += scanline;
+    if (quality > 0) {
+        float scanline = sin(uv.y * 1000.0 + time * 10.0) * 0.05;
+        color.rgb += scanline;
+    }
 
-    color.rgb *= 0.9 + 0.1 * rand(uv + time);
+    if (quality > 1) {
+        color.rgb *= 0.9 + 0.1 * rand(uv + time);
+    }
 
-    vec2 vig = uv - 0.5;
-    color.rgb *= 1.0 - dot(vig, vig) * 1.5  * noise_cof;
+    if (quality > 0) {
+        vec2 vig = uv - 0.5;
+        color.rgb *= 1.0 - dot(vig, vig) * 1.5  * noise_cof;
+    }
 
-    color.rgb += (noise(uv * 50.0 + time) - 0.5) * 0.1 * noise_cof; 
+    if (quality > 1) {
+        color.rgb += (noise(uv * 50.0 + time) - 0.5) * 0.1 * noise_cof; 
+    }
 
     color.rgb = mix(vec3(dot(color.rgb, vec3(0.299, 0.587, 0.114))), color.rgb, 0.8);
     color.rgb = mix(vec3(dot(color.rgb, vec3(0, 0, 0))), color.rgb, 0.8);
@@ -0,0 +1,27 @@
+#version 330 core
+
+uniform vec2 resolution;
+uniform vec3 fill;
+uniform float radius;
+uniform float flash;
+
+in vec2 uvs;
+out vec4 f_color;
+
+void main() {
+    vec2 pixel = uvs * resolution;
+
+    // iris: everything outside the radius is filled, negative radius turns it off
+    if (radius >= 0.0 && distance(pixel, resolution * 0.5) >= radius) {
+        f_color = vec4(fill, 1.0);
+        return;
+    }
+
+    // flash: white fading over the fill across the whole frame, negative turns it off
+    if (flash >= 0.0) {
+        f_color = vec4(mix(fill, vec3(1.0), flash), 1.0);
+        return;
+    }
+
+    discard;
+}
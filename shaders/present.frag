@@ -0,0 +1,11 @@
+#version 330 core
+
+uniform sampler2D tex;
+
+in vec2 uvs;
+out vec4 f_color;
+
+void main() {
+    // the low resolution target is laid out like the screen, bottom row first, while uvs start at the top
+    f_color = texture(tex, vec2(uvs.x, 1.0 - uvs.y));
+}
@@ -0,0 +1,39 @@
+#version 330 core
+
+uniform sampler2D atlas;
+uniform isampler2D tiles;
+uniform usampler2D rotations;
+uniform bool rotate;
+uniform int tile_size;
+
+flat in ivec2 grid;
+flat in ivec2 corner;
+out vec4 f_color;
+
+vec4 tile_texel(int tile_id, ivec2 local) {
+    int columns = textureSize(atlas, 0).x / tile_size;
+    return texelFetch(atlas, ivec2(tile_id % columns, tile_id / columns) * tile_size + local, 0);
+}
+
+// quarter turns counter-clockwise, matching pygame.transform.rotate
+ivec2 rotated(ivec2 p, uint turns) {
+    int last = tile_size - 1;
+    if (turns == 1u) return ivec2(last - p.y, p.x);
+    if (turns == 2u) return ivec2(last - p.x, last - p.y);
+    if (turns == 3u) return ivec2(p.y, last - p.x);
+    return p;
+}
+
+void main() {
+    ivec2 local = ivec2(gl_FragCoord.xy) - corner;
+    if (rotate) {
+        local = rotated(local, texelFetch(rotations, grid, 0).r);
+    }
+    vec4 color = tile_texel(texelFetch(tiles, grid, 0).r, local);
+
+    // black is the colour key, same as on the surfaces
+    if (color.rgb == vec3(0.0)) {
+        discard;
+    }
+    f_color = vec4(color.rgb, 1.0);
+}
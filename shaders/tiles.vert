@@ -0,0 +1,30 @@
+#version 330 core
+
+uniform isampler2D tiles;
+uniform ivec2 origin;
+uniform ivec2 first_tile;
+uniform int columns;
+uniform ivec2 scroll;
+uniform vec2 resolution;
+uniform int tile_size;
+
+in vec2 vert;
+flat out ivec2 grid;
+flat out ivec2 corner;
+
+void main() {
+    ivec2 cell = first_tile + ivec2(gl_InstanceID % columns, gl_InstanceID / columns);
+    grid = cell - origin;
+    corner = cell * tile_size - scroll;
+
+    // empty cells collapse to a point so they cost no fragments
+    bool inside = all(greaterThanEqual(grid, ivec2(0))) && all(lessThan(grid, textureSize(tiles, 0)));
+    if (!inside || texelFetch(tiles, grid, 0).r < 0) {
+        gl_Position = vec4(2.0, 2.0, 0.0, 1.0);
+        return;
+    }
+
+    // pixel row 0 ends up in texture row 0, the same way uploaded surfaces are laid out
+    vec2 pixel = vec2(corner) + vert * float(tile_size);
+    gl_Position = vec4(pixel / resolution * 2.0 - 1.0, 0.0, 1.0);
+}
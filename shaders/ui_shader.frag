@@ -2,6 +2,8 @@
 
 uniform sampler2D tex;
 uniform float time;
+// same levels as game_shader
+uniform int quality = 2;
 
 in vec2 uvs;
 out vec4 f_color;
@@ -27,19 +29,29 @@ void main() {
     vec2 offset = vec2(0.001, 0.001);
     vec4 color = texture(tex, uv);
 
-    color.r = texture(tex, uv + offset * vec2(-1.0, 0.5) * (1.0 + sin(time))*0.8).r;
-    color.g = texture(tex, uv + offset * vec2(0.0, -0.5) * (1.0 + cos(time))*0.8).g;
-    color.b = texture(tex, uv + offset * vec2(1.0, 0.5) * (1.0 + sin(time))*0.8).b;
+    if (quality > 1) {
+        color.r = texture(tex, uv + offset * vec2(-1.0, 0.5) * (1.0 + sin(time))*0.8).r;
+        color.g = texture(tex, uv + offset * vec2(0.0, -0.5) * (1.0 + cos(time))*0.8).g;
+        color.b = texture(tex, uv + offset * vec2(1.0, 0.5) * (1.0 + sin(time))*0.8).b;
+    }
 
-    float scanline = sin(uv.y * 1000.0 + time * 10.0) * 0.01;
-    color.rgb += scanline;
+    if (quality > 0) {
+        float scanline = sin(uv.y * 1000.0 + time * 10.0) * 0.01;
+        color.rgb += scanline;
+    }
 
-    color.rgb *= 0.9 + 0.1 * rand(uv + time);
+    if (quality > 1) {
+        color.rgb *= 0.9 + 0.1 * rand(uv + time);
+    }
 
-    vec2 vig = uv - 0.5;
-    color.rgb *= 1.0 - dot(vig, vig) * 1.01;
+    if (quality > 0) {
+        vec2 vig = uv - 0.5;
+        color.rgb *= 1.0 - dot(vig, vig) * 1.01;
+    }
 
-    color.rgb += (noise(uv * 50.0 + time) - 0.5) * 0.05;
+    if (quality > 1) {
+        color.rgb += (noise(uv * 50.0 + time) - 0.5) * 0.05;
+    }
 
     color.rgb = mix(vec3(dot(color.rgb, vec3(0.299, 0.587, 0.114))), color.rgb, 0.6);
     color.rgb = mix(vec3(dot(color.rgb, vec3(0, 0, 0))), color.rgb, 0.99);